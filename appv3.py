@@ -1,13 +1,32 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import matplotlib.pyplot as plt
 from streamlit_option_menu import option_menu
 #from streamlit_extras.metric_cards import style_metric_cards
 import warnings
-from io import StringIO
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+import contextvars
 import datetime
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Without pyarrow the exports are parsed from CSV every time
+    pa = pq = None
 
 # Disable warnings
 warnings.filterwarnings('ignore')
@@ -30,12 +49,1286 @@ st.markdown(
     unsafe_allow_html=True
 )
 
+BUCKET = 'stripe-raw-data-dashboard'
+
+# Stripe exports used by the dashboard pages. Per export:
+#   key          the S3 object
+#   dates        timestamp columns parsed at load time
+#   date_format  the format those timestamps are written in
+#   index        the timestamp column the dataset is sorted and windowed by
+#   append_only  True if the export only ever grows by appended rows
+#   columns      the columns the pages read; everything else stays in the snapshot only
+#   schema       compact in-memory types: IDs and free text as Arrow-backed strings,
+#                low-cardinality fields as categoricals, money as int64 cents
+DATASETS = {
+    'invoices': {
+        'key': 'Untitled_report.csv',
+        'dates': ['created'],
+        'date_format': '%Y-%m-%d %H:%M:%S',
+        'index': 'created',
+        'append_only': True,
+        'columns': ['created', 'customer_id', 'email', 'phone', 'name', 'subscription', 'invoice_number',
+                    'description', 'quantity', 'currency', 'line_item_amount', 'total_invoice_amount',
+                    'discount', 'fee', 'tax', 'net_amount'],
+        'schema': {
+            'strings': ['customer_id', 'email', 'name', 'invoice_number', 'description'],
+            'categories': ['currency', 'subscription'],
+            'cents': ['line_item_amount', 'total_invoice_amount', 'discount', 'fee', 'tax', 'net_amount'],
+        },
+    },
+    'customers': {
+        'key': 'customers_6months.csv',
+        'dates': ['created'],
+        'date_format': '%Y-%m-%d %H:%M:%S',
+        'index': 'created',
+        'columns': ['id', 'created', 'email', 'phone', 'name', 'address_country', 'deleted',
+                    'shipping_address_city', 'shipping_address_country'],
+        'schema': {
+            'strings': ['id', 'email', 'name', 'shipping_address_city'],
+            'categories': ['address_country', 'shipping_address_country'],
+        },
+    },
+    'subscriptions': {
+        'key': 'subscriptions_6months.csv',
+        'dates': ['created', 'trial_start', 'trial_end'],
+        'date_format': '%Y-%m-%d %H:%M:%S',
+        'index': 'trial_end',
+        'columns': ['customer_id', 'created', 'trial_start', 'trial_end', 'start_date', 'status'],
+        'schema': {
+            'strings': ['customer_id'],
+            'categories': ['status'],
+        },
+    },
+    'payments': {
+        'key': 'both_success_fail.csv',
+        'dates': ['created_date'],
+        'date_format': '%Y-%m-%d %H:%M:%S',
+        'index': 'created_date',
+        'append_only': True,
+        'columns': ['id', 'amount', 'amount_refunded', 'balance_transaction_id', 'calculated_statement_descriptor',
+                    'created_date', 'currency', 'customer_id', 'description', 'status', 'refunded', 'failure_code'],
+        'schema': {
+            'strings': ['id', 'balance_transaction_id', 'customer_id', 'description'],
+            'categories': ['currency', 'status', 'failure_code'],
+        },
+    },
+    'financial': {
+        'key': 'financial.csv',
+        'dates': ['month'],
+        'date_format': '%Y-%m-%d',
+        'index': 'month',
+        'columns': ['month', 'currency', 'total_sales', 'total_refunds', 'total_payouts', 'net_profit_loss'],
+        'schema': {
+            'categories': ['currency'],
+        },
+    },
+}
+
+CACHE_TTL_SECONDS = 300  # How long a cached dataset is served before its ETag is revalidated
+CACHE_MEMORY_BUDGET_BYTES = 2 * 1024 ** 3  # Least recently used datasets are evicted above this size
+CHART_MAX_POINTS = 400  # Time series are bucketed coarser until they fit in this many bars
+TABLE_PAGE_SIZES = [100, 500, 1000]  # Rows per page offered by the VIEW DATA tables
+TABLE_CACHE_ENTRIES = 16  # Sorted/filtered row orders kept for paging through VIEW DATA tables
+AGGREGATE_CACHE_ENTRIES = 512  # Aggregate results kept per process, least recently used evicted first
+SNAPSHOT_DIR = 'snapshots'  # Local Parquet copies of the exports, one per S3 object version
+SNAPSHOT_FORMAT = 3  # Bump whenever the stored column types or values change so older snapshots are ignored
+CSV_CHUNK_ROWS = 200_000  # Rows parsed at a time when streaming an export from S3
+TAIL_BYTES = 64 * 1024  # Bytes kept from the end of an export to check the ingested prefix on the next append
+FULL_RELOAD_SECONDS = 3600  # Appends are read as deltas for at most this long, so edits to old rows still land
+STRING_DTYPE = 'string[pyarrow]' if pa is not None else None  # Without pyarrow strings stay object dtype
+
+class RenderProfile:
+    """Timings, row counts and bytes for each stage of one page render."""
+
+    def __init__(self, page):
+        self.page = page
+        self.started = time.perf_counter()
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, rows=None, nbytes=None, started=None):
+        # `started` is seconds into the render, so nested stages can be told apart from sequential ones
+        with self._lock:
+            self.stages.append({'stage': stage, 'seconds': seconds, 'rows': rows, 'bytes': nbytes, 'started': started})
+
+    def summary(self):
+        """Stages with repeated names (e.g. per-chunk parsing) summed, in first-seen order."""
+        totals = {}
+        for record in self.stages:
+            total = totals.setdefault(record['stage'], {'stage': record['stage'], 'calls': 0, 'seconds': 0.0,
+                                                         'rows': None, 'bytes': None})
+            total['calls'] += 1
+            total['seconds'] += record['seconds']
+            for field in ('rows', 'bytes'):
+                if record[field] is not None:
+                    total[field] = (total[field] or 0) + record[field]
+        return list(totals.values())
+
+    def log_line(self):
+        return json.dumps({
+            'event': 'page_render',
+            'page': self.page,
+            'total_seconds': round(time.perf_counter() - self.started, 4),
+            'stages': [{**stage, 'seconds': round(stage['seconds'], 4)} for stage in self.summary()],
+        }, default=str)
+
+
+@st.cache_resource
+def _render_profile_var():
+    # Streamlit re-executes this module on every rerun; cached objects such as the
+    # DatasetCache keep calling functions from the run that created them, so the
+    # context variable itself has to be shared across reruns
+    return contextvars.ContextVar('render_profile', default=None)
+
+
+_render_profile = _render_profile_var()
+perf_logger = logging.getLogger('dashboard.perf')
+if not perf_logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(message)s'))
+    perf_logger.addHandler(_handler)
+    perf_logger.setLevel(logging.INFO)
+    perf_logger.propagate = False
+
+
+@contextmanager
+def timed(stage, rows=None, nbytes=None):
+    """Record how long the block takes in the active RenderProfile, if any.
+
+    Yields a dict whose 'rows' and 'bytes' can be filled in once the block knows them.
+    """
+    profile = _render_profile.get()
+    stats = {'rows': rows, 'bytes': nbytes}
+    if profile is None:
+        yield stats
+        return
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        profile.record(stage, time.perf_counter() - start, stats['rows'], stats['bytes'], start - profile.started)
+
+
+@contextmanager
+def profile_render(page):
+    """Make a RenderProfile active for the page render and log it as one JSON line when done."""
+    profile = RenderProfile(page)
+    token = _render_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _render_profile.reset(token)
+        perf_logger.info(profile.log_line())
+
+
+def build_figure(plot, *args, **kwargs):
+    """Call a plotly.express function, timing it under the chart's title."""
+    with timed(f"figure: {kwargs.get('title', plot.__name__)}"):
+        return plot(*args, **kwargs)
+
+
+def plotly_chart(fig, **kwargs):
+    """st.plotly_chart, timing the serialisation under the chart's title."""
+    with timed(f"plotly_chart: {fig.layout.title.text}"):
+        st.plotly_chart(fig, **kwargs)
+
+
+def show_performance_panel(profile):
+    st.subheader("Performance")
+    summary = pd.DataFrame(profile.summary())
+    if not summary.empty:
+        summary['seconds'] = summary['seconds'].round(4)
+    st.caption(f"Total render time: {time.perf_counter() - profile.started:.3f}s")
+    st.dataframe(summary, use_container_width=True)
+
+
+# Shared S3 client settings
+S3_MAX_POOL_CONNECTIONS = 20  # Enough for every prefetch worker plus concurrent sessions
+S3_CONNECT_TIMEOUT_SECONDS = 5
+S3_READ_TIMEOUT_SECONDS = 60
+S3_MAX_ATTEMPTS = 5  # Retried with botocore's adaptive mode (exponential backoff plus client-side rate limiting)
+
+
+@st.cache_resource
+def get_s3_client():
+    """Process-wide S3 client reused by every loader; boto3 clients are thread-safe once created."""
+    config = Config(
+        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+        connect_timeout=S3_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=S3_READ_TIMEOUT_SECONDS,
+        tcp_keepalive=True,
+        retries={'max_attempts': S3_MAX_ATTEMPTS, 'mode': 'adaptive'},
+    )
+    return boto3.client('s3', config=config)
+
+
+def s3_connection_stats(s3_client):
+    """Requests sent and connections opened by the client's urllib3 pools.
+
+    A reuse ratio close to 1 means requests ride on kept-alive connections and
+    TLS handshakes are off the hot path.
+    """
+    endpoint = getattr(s3_client, '_endpoint', None)
+    manager = getattr(getattr(endpoint, 'http_session', None), '_manager', None)
+    pools = [manager.pools[pool_key] for pool_key in manager.pools.keys()] if manager is not None else []
+    requests = sum(pool.num_requests for pool in pools)
+    connections = sum(pool.num_connections for pool in pools)
+    return {
+        'pools': len(pools),
+        'requests': requests,
+        'connections': connections,
+        'reuse_ratio': round(1 - connections / requests, 3) if requests else None,
+    }
+
+
+class Dataset:
+    """One loaded version of an export and the artifacts derived from it.
+
+    Derived artifacts (rollups, lookup tables) are built on first use and live
+    exactly as long as this version of the data, so a reload never serves stale
+    aggregates. Artifacts registered with an `extend` function are carried into
+    the next version by `extend()` instead of being rebuilt from every row.
+    """
+
+    def __init__(self, df, etag, spec, size=None, header=None, tail=None, loaded_at=None, nbytes=None):
+        index = spec['index']
+        if not df[index].is_monotonic_increasing:
+            df = df.sort_values(index, kind='stable', na_position='last', ignore_index=True)
+        # Snapshots read strings back as Python objects and appended rows arrive uncategorised
+        self.df = _apply_categories(_apply_strings(_compact_cents(df, spec), spec), spec)
+        self.etag = etag
+        self.spec = spec
+        self.index = index
+        self.size = size  # Bytes of the S3 object ingested so far
+        self.header = header  # Column names of the raw CSV, needed to parse an appended tail
+        self.tail = tail  # Last complete line ingested, re-read to check the prefix before appending
+        self.checked_at = time.monotonic()
+        self.loaded_at = loaded_at or self.checked_at  # When the export was last read in full
+        self.nbytes = nbytes if nbytes is not None else int(self.df.memory_usage(deep=True).sum())
+        self._derived = {}
+        self._extenders = {}
+        self._lock = threading.Lock()
+
+    def derived(self, name, build, extend=None):
+        """Return `build(df)`, computed once per dataset version.
+
+        `extend(value, delta)` updates an already built value with appended rows;
+        when given, the value follows the dataset through `extend()`.
+        """
+        with self._lock:
+            if name not in self._derived:
+                with timed(f'build: {name}', rows=len(self.df)):
+                    self._derived[name] = build(self.df)
+            if extend is not None:
+                self._extenders[name] = extend
+            return self._derived[name]
+
+    def period(self, column, freq, rows=None):
+        """`column` as periods of `freq` ('D', 'M', ...), converted once per version.
+
+        Pass `rows`, e.g. a window of this dataset, to get just their periods.
+        """
+        periods = self.derived(f'period: {column} {freq}', lambda df: df[column].dt.to_period(freq))
+        return periods if rows is None else periods.reindex(rows.index)
+
+    def window(self, start_date, end_date):
+        """Rows whose index column falls between the two dates (whole days, inclusive)."""
+        with timed('filter') as stats:
+            selection = slice_window(self.df, self.index, start_date, end_date)
+            stats['rows'] = len(selection)
+        return selection
+
+    def extend(self, delta, etag, size, tail):
+        """Return the next version of this dataset with `delta` rows appended.
+
+        The delta is typed against the existing columns first, so the existing
+        rows keep their categories and only the delta's bytes are measured.
+        """
+        if not len(delta):
+            return Dataset(self.df, etag, self.spec, size, self.header, tail, self.loaded_at, self.nbytes)
+        df = self.df
+        delta = _compact_cents(_apply_strings(delta, self.spec), self.spec)
+        for column in self.spec.get('schema', {}).get('categories', []):
+            if column not in delta.columns or not isinstance(df[column].dtype, pd.CategoricalDtype):
+                continue
+            categories = df[column].cat.categories
+            values = pd.unique(delta[column].dropna())
+            added = values[~pd.Index(values).isin(categories)]
+            if len(added):
+                df = df.assign(**{column: df[column].cat.add_categories(added)})
+                categories = df[column].cat.categories
+            delta[column] = pd.Categorical(delta[column], categories=categories)
+        nbytes = self.nbytes + int(delta.memory_usage(deep=True).sum())
+        dataset = Dataset(pd.concat([df, delta], ignore_index=True), etag, self.spec, size, self.header, tail,
+                          self.loaded_at, nbytes)
+        with self._lock:
+            carried = [(name, extend, self._derived[name]) for name, extend in self._extenders.items()]
+        for name, extend, value in carried:
+            with timed(f'build: {name} (appended rows)', rows=len(delta)):
+                dataset._derived[name] = extend(value, delta)
+            dataset._extenders[name] = extend
+        return dataset
+
+    def memory_report(self, sample_rows=10_000):
+        """Bytes held by each typed column against pandas' default dtypes (object strings, float64 amounts)."""
+        report = {}
+        schema = self.spec.get('schema', {})
+        sample = self.df.iloc[:sample_rows]
+        scale = len(self.df) / len(sample) if len(sample) else 0
+        for column in schema.get('strings', []) + schema.get('categories', []) + schema.get('cents', []):
+            if column not in self.df.columns:
+                continue
+            if column in schema.get('cents', []):
+                default_bytes = len(self.df) * 8
+            else:
+                default_bytes = int(sample[column].astype(object).memory_usage(deep=True, index=False) * scale)
+            typed_bytes = int(self.df[column].memory_usage(deep=True, index=False))
+            report[column] = {'default_bytes': default_bytes, 'typed_bytes': typed_bytes}
+        report['bytes_saved'] = sum(column['default_bytes'] - column['typed_bytes'] for column in report.values())
+        return report
+
+
+def slice_window(df, column, start_date, end_date):
+    """Slice a frame sorted by `column` to start_date..end_date using binary search.
+
+    The end date is inclusive, so everything before the following midnight is
+    kept. Rows with a missing timestamp sort last and are never included.
+    """
+    start = pd.Timestamp(start_date)
+    end_of_day = pd.Timestamp(end_date) + pd.Timedelta(days=1)
+    values = df[column]
+    return df.iloc[values.searchsorted(start, side='left'):values.searchsorted(end_of_day, side='left')]
+
+
+class DatasetCache:
+    """Parsed S3 datasets kept in process memory, keyed by (bucket, key).
+
+    Entries are served without touching S3 for `ttl` seconds, then revalidated
+    with a conditional head_object on the stored ETag and only reloaded when
+    the object changed. Concurrent requests for a key that is already loading
+    wait for that load instead of starting another. Frames returned from the
+    cache are shared, so callers must treat them as read-only.
+    """
+
+    def __init__(self, s3_client, ttl=CACHE_TTL_SECONDS, memory_budget=CACHE_MEMORY_BUDGET_BYTES):
+        self.s3_client = s3_client
+        self.ttl = ttl
+        self.memory_budget = memory_budget
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, bucket, key, load):
+        """Return the cached Dataset, calling `load(s3_client, head, previous)` -> Dataset when it is missing or stale."""
+        cache_key = (bucket, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries.move_to_end(cache_key)
+
+        if entry is not None and time.monotonic() - entry.checked_at < self.ttl:
+            return entry
+
+        with self._lock:
+            future = self._loading.get(cache_key)
+            owner = future is None
+            if owner:
+                future = self._loading[cache_key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            entry = self._refresh(bucket, key, entry, load)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(entry)
+        finally:
+            with self._lock:
+                del self._loading[cache_key]
+        return entry
+
+    def _refresh(self, bucket, key, entry, load):
+        head = self._head(bucket, key, entry.etag if entry is not None else None)
+        if head is None:
+            entry.checked_at = time.monotonic()
+            return entry
+
+        entry = load(self.s3_client, head, entry)
+        with self._lock:
+            self._entries[(bucket, key)] = entry
+            self._entries.move_to_end((bucket, key))
+            self._evict()
+        return entry
+
+    def _head(self, bucket, key, etag):
+        # Returns None when the object still matches `etag`
+        with timed('s3 head_object'):
+            if etag is None:
+                return self.s3_client.head_object(Bucket=bucket, Key=key)
+            try:
+                return self.s3_client.head_object(Bucket=bucket, Key=key, IfNoneMatch=etag)
+            except ClientError as e:
+                if e.response['Error']['Code'] in ('304', 'NotModified'):
+                    return None
+                raise
+
+    def datasets(self):
+        """The datasets currently held, keyed by S3 key."""
+        with self._lock:
+            return {key: entry for (_, key), entry in self._entries.items()}
+
+    def _evict(self):
+        # Always keep the most recently used entry, even if it alone exceeds the budget
+        total = sum(entry.nbytes for entry in self._entries.values())
+        while total > self.memory_budget and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            total -= entry.nbytes
+
+
+@st.cache_resource
+def get_dataset_cache():
+    return DatasetCache(get_s3_client())
+
+
+class AggregateCache:
+    """Aggregate results shared by every session, keyed by dataset version, date window and name.
+
+    Keying on the ETag means a reloaded export never serves stale results; the
+    old entries just age out. Results are shared, so callers must treat them as
+    read-only.
+    """
+
+    def __init__(self, max_entries=AGGREGATE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, dataset, start_date, end_date, name, build):
+        """Return the cached `name` aggregate for the window, calling `build()` on a miss."""
+        cache_key = (dataset.spec['key'], dataset.etag, start_date, end_date, name)
+        with self._lock:
+            if cache_key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(cache_key)
+                return self._entries[cache_key]
+            self.misses += 1
+
+        # Two sessions missing at once both build; the results are identical
+        result = build()
+        with self._lock:
+            self._entries[cache_key] = result
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': round(self.hits / lookups, 3) if lookups else None}
+
+
+@st.cache_resource
+def get_aggregate_cache():
+    return AggregateCache()
+
+
+@st.cache_resource
+def get_table_cache():
+    # Sorted/filtered row positions for the VIEW DATA tables; each can be as long as a window
+    return AggregateCache(max_entries=TABLE_CACHE_ENTRIES)
+
+
+def _month_ordinals(timestamps):
+    # Months since 1970-01 as int64, -1 where the timestamp is missing
+    periods = timestamps.dt.to_period('M')
+    return np.where(periods.isna(), -1, periods.array.asi8)
+
+
+class RetentionMatrix:
+    """Monthly sign-up cohorts x months since sign-up, as NumPy arrays.
+
+    Rolling retention: a customer counts as retained at age k if they created a
+    subscription k or more months after the month they signed up in, so every
+    customer is retained at age 0. `counts[c, a]` holds how many customers of
+    cohort c created their latest subscription at age a; retention at age k is
+    the sum over ages >= k. Customers and subscriptions can be added at any
+    time and only move the customers they touch from one cell to another.
+    """
+
+    def __init__(self):
+        self.customer_ids = pd.Index([], dtype=object)
+        self.cohort = np.empty(0, dtype=np.int64)  # Sign-up month ordinal per customer
+        self.last_active = np.empty(0, dtype=np.int64)  # Month of the latest subscription, or the sign-up month
+        self.first_cohort = 0
+        self.counts = np.zeros((0, 1), dtype=np.int64)
+        self.latest = -1  # Latest month with any data, as an ordinal
+
+    def _fit(self, months, ages):
+        # Grow the matrix to cover cohorts `months` and `ages` months since sign-up
+        first = min(int(months.min()), self.first_cohort) if len(self.counts) else int(months.min())
+        last = max(int(months.max()), self.first_cohort + len(self.counts) - 1) if len(self.counts) else int(months.max())
+        width = max(self.counts.shape[1], ages)
+        if (first, last - first + 1, width) == (self.first_cohort, *self.counts.shape):
+            return
+        grown = np.zeros((last - first + 1, width), dtype=np.int64)
+        offset = self.first_cohort - first
+        grown[offset:offset + len(self.counts), :self.counts.shape[1]] = self.counts
+        self.first_cohort, self.counts = first, grown
+
+    def add_customers(self, customers):
+        """Add customers not seen before, first row per id; returns their ids."""
+        with timed('build: retention customers', rows=len(customers)):
+            customers = customers[['id', 'created']].dropna().drop_duplicates(subset='id')
+            customers = customers[~customers['id'].isin(self.customer_ids)]
+            if customers.empty:
+                return customers['id']
+            cohort = _month_ordinals(customers['created'])
+            self._fit(cohort, 1)
+            np.add.at(self.counts, (cohort - self.first_cohort, 0), 1)
+            self.customer_ids = self.customer_ids.append(pd.Index(customers['id'], dtype=object))
+            self.cohort = np.concatenate([self.cohort, cohort])
+            self.last_active = np.concatenate([self.last_active, cohort])
+            self.latest = max(self.latest, int(cohort.max()))
+            return customers['id']
+
+    def apply(self, subscriptions):
+        """Fold subscription rows in. Rows already applied can be passed again; they change nothing."""
+        with timed('build: retention subscriptions', rows=len(subscriptions)):
+            positions = self.customer_ids.get_indexer(subscriptions['customer_id'])
+            months = _month_ordinals(subscriptions['created'])
+            keep = (positions >= 0) & (months >= 0)
+            positions, months = positions[keep], months[keep]
+            keep = months > self.last_active[positions]
+            positions, months = positions[keep], months[keep]
+            if not len(positions):
+                return
+
+            latest = pd.Series(months).groupby(positions).max()
+            positions, months = latest.index.to_numpy(), latest.to_numpy()
+            rows = self.cohort[positions] - self.first_cohort
+            old_ages = self.last_active[positions] - self.cohort[positions]
+            new_ages = months - self.cohort[positions]
+            self._fit(self.cohort[positions], int(new_ages.max()) + 1)
+            np.subtract.at(self.counts, (rows, old_ages), 1)
+            np.add.at(self.counts, (rows, new_ages), 1)
+            self.last_active[positions] = months
+            self.latest = max(self.latest, int(months.max()))
+
+    def cohorts(self):
+        """Cohort labels ('YYYY-MM'), oldest first."""
+        start = pd.Period(ordinal=self.first_cohort, freq='M')
+        return pd.period_range(start, periods=self.counts.shape[0], freq='M').astype(str)
+
+    def retention(self):
+        """(cohort sizes, customers retained per cohort and age) as arrays."""
+        retained = self.counts[:, ::-1].cumsum(axis=1)[:, ::-1]
+        return retained[:, 0], retained
+
+    def rates(self, start_date=None, end_date=None):
+        """Percent of each cohort retained by age, for cohorts signing up between the two dates.
+
+        Ages later than the data reaches are NaN rather than 0.
+        """
+        sizes, retained = self.retention()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates = retained / sizes[:, None] * 100
+        cohort_months = self.first_cohort + np.arange(len(sizes))
+        observed = cohort_months[:, None] + np.arange(rates.shape[1])[None, :] <= self.latest
+        rates = np.where(observed, rates, np.nan)
+        rows = np.ones(len(sizes), dtype=bool)
+        if start_date is not None:
+            rows &= cohort_months >= pd.Timestamp(start_date).to_period('M').ordinal
+        if end_date is not None:
+            rows &= cohort_months <= pd.Timestamp(end_date).to_period('M').ordinal
+        rows &= sizes > 0
+        return pd.DataFrame(rates[rows], index=self.cohorts()[rows], columns=range(rates.shape[1])).round(1)
+
+
+class RetentionStore:
+    """One retention matrix kept up to date with every customers and subscriptions version, shared by every session.
+
+    Neither export is append-only or sorted by creation time, so new rows are
+    found by their `created` timestamp instead: each new version only folds in
+    customers and subscriptions created at or after the latest one already
+    applied, plus the subscriptions of customers that just appeared. Rows
+    removed from an export stay counted until the process restarts. The matrix
+    changes in place, so it is only read under the store's lock.
+    """
+
+    def __init__(self):
+        self._matrix = RetentionMatrix()
+        self._etags = (None, None)  # (customers, subscriptions) versions applied
+        self._watermarks = (None, None)  # Latest `created` applied from each
+        self._lock = threading.Lock()
+
+    def rates(self, customers, subscriptions, start_date=None, end_date=None):
+        """`RetentionMatrix.rates` once the matrix has caught up with these dataset versions."""
+        with self._lock:
+            self._update(customers, subscriptions)
+            return self._matrix.rates(start_date, end_date)
+
+    def _update(self, customers, subscriptions):
+        if self._etags != (customers.etag, subscriptions.etag):
+            customers_since, subscriptions_since = self._watermarks
+            subs = subscriptions.df
+            new_ids = self._matrix.add_customers(_created_since(customers.df, customers_since))
+            self._matrix.apply(_created_since(subs, subscriptions_since))
+            if len(new_ids):
+                self._matrix.apply(subs[subs['customer_id'].isin(new_ids)])
+            self._etags = (customers.etag, subscriptions.etag)
+            self._watermarks = (customers.df['created'].max(), subs['created'].max())
+
+
+def _created_since(df, watermark):
+    # Rows created at or after `watermark` (all of them when there is none yet)
+    if watermark is None or pd.isna(watermark):
+        return df
+    return df[df['created'] >= watermark]
+
+
+@st.cache_resource
+def get_retention_store():
+    return RetentionStore()
+
+
+def _to_datetime(values, date_format=None):
+    # Epoch seconds parse without a format; strings use the declared one, and only
+    # values that don't match it fall back to pandas' format inference
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.to_datetime(values, unit='s', errors='coerce')
+    parsed = pd.to_datetime(values, format=date_format, errors='coerce')
+    if date_format is not None:
+        missed = parsed.isna() & values.notna()
+        if missed.any():
+            # Kept naive like the rest of the column (offsets are converted to UTC)
+            parsed[missed] = pd.to_datetime(values[missed], errors='coerce', utc=True).dt.tz_localize(None)
+    return parsed
+
+
+def _parse_dates(df, spec):
+    for column in spec['dates']:
+        if column in df.columns:
+            df[column] = _to_datetime(df[column], spec.get('date_format'))
+    return df
+
+
+def _apply_cents(df, spec):
+    # Only ever applied to freshly parsed CSV chunks; snapshots already hold cents
+    for column in spec.get('schema', {}).get('cents', []):
+        if column in df.columns:
+            df[column] = _cents_dtype((pd.to_numeric(df[column], errors='coerce') * 100).round())
+    return df
+
+
+def _cents_dtype(values):
+    # Plain int64 is 8 bytes a value; the nullable Int64 mask adds a ninth, so only use it when there are gaps
+    dtype = 'Int64' if values.isna().any() else 'int64'
+    return values if values.dtype == dtype else values.astype(dtype)
+
+
+def _compact_cents(df, spec):
+    # Snapshots read gappy cents columns back as float64, and chunks may disagree on whether they had gaps
+    for column in spec.get('schema', {}).get('cents', []):
+        if column in df.columns and df[column].dtype != 'int64':
+            df[column] = _cents_dtype(df[column])
+    return df
+
+
+def _apply_strings(df, spec):
+    if STRING_DTYPE is not None:
+        for column in spec.get('schema', {}).get('strings', []):
+            if column in df.columns and df[column].dtype != STRING_DTYPE:
+                df[column] = df[column].astype(STRING_DTYPE)
+    return df
+
+
+def _apply_categories(df, spec):
+    # Categories need the whole column, otherwise every chunk would get its own
+    for column in spec.get('schema', {}).get('categories', []):
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    return df
+
+
+def _snapshot_path(key, etag):
+    stem = os.path.splitext(os.path.basename(key))[0]
+    return os.path.join(SNAPSHOT_DIR, f"{stem}-v{SNAPSHOT_FORMAT}-{re.sub(r'[^0-9A-Za-z]', '', etag)}.parquet")
+
+
+class SnapshotWriter:
+    """Writes a parsed export chunk by chunk into a compressed Parquet snapshot.
+
+    The snapshot only replaces older versions of the same object once `close()`
+    succeeds; a chunk pyarrow can't coerce to the first chunk's schema abandons
+    the snapshot without interrupting the load.
+    """
+
+    def __init__(self, key, etag):
+        self.key = key
+        self.path = _snapshot_path(key, etag)
+        self._tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        self._writer = None
+        self.failed = False
+
+    def write(self, chunk):
+        if self.failed:
+            return
+        try:
+            if self._writer is None:
+                os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                self._writer = pq.ParquetWriter(self._tmp_path, table.schema, compression='zstd')
+            else:
+                table = pa.Table.from_pandas(chunk, schema=self._writer.schema, preserve_index=False)
+            self._writer.write_table(table)
+        except (ValueError, TypeError):
+            self.abort()
+
+    def close(self):
+        if self.failed or self._writer is None:
+            return
+        self._writer.close()
+        os.replace(self._tmp_path, self.path)
+
+        stem = os.path.splitext(os.path.basename(self.key))[0]
+        for old_path in glob.glob(os.path.join(SNAPSHOT_DIR, f"{stem}-*.parquet")):
+            if old_path != self.path:
+                os.remove(old_path)
+
+    def abort(self):
+        self.failed = True
+        if self._writer is not None:
+            self._writer.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def read_snapshot(key, etag, columns=None):
+    """Read the snapshot for this object version, or None if it hasn't been materialised."""
+    if pq is None or etag is None:
+        return None
+    path = _snapshot_path(key, etag)
+    if not os.path.exists(path):
+        return None
+    if columns is not None:
+        available = set(pq.read_schema(path).names)
+        columns = [column for column in columns if column in available]
+    return pd.read_parquet(path, columns=columns)
+
+
+def read_csv_stream(body, spec, snapshot=None, chunk_rows=CSV_CHUNK_ROWS, names=None):
+    """Parse a CSV stream (e.g. an S3 StreamingBody) in chunks of `chunk_rows`.
+
+    Only the projected columns of each chunk are kept, so the raw bytes and the
+    decoded text are never held whole. The final concat copies the chunks into
+    one frame, so peak memory is about twice the projected frame. Full chunks go
+    to `snapshot` when one is given.
+    Pass `names` for a stream without a header line, such as an appended tail.
+    Returns the frame and the CSV's column names. If the stream fails part way
+    (a parse error, a timeout, a dropped connection) the snapshot is abandoned.
+    """
+    chunks = []
+    header = names
+    try:
+        reader = pd.read_csv(body, chunksize=chunk_rows, header=None if names else 'infer', names=names)
+        while True:
+            # Decoding happens inside the parser, so it is timed as part of parsing
+            with timed('parse csv') as stats:
+                chunk = next(reader, None)
+                stats['rows'] = len(chunk) if chunk is not None else 0
+            if chunk is None:
+                break
+            header = list(chunk.columns)
+            with timed('to_datetime', rows=len(chunk)):
+                _parse_dates(chunk, spec)
+            with timed('apply schema', rows=len(chunk)):
+                _apply_cents(chunk, spec)
+                _apply_strings(chunk, spec)
+            if snapshot is not None:
+                snapshot.write(chunk)
+            chunks.append(chunk[[column for column in spec['columns'] if column in chunk.columns]])
+        if snapshot is not None:
+            snapshot.close()
+    except BaseException:
+        if snapshot is not None:
+            snapshot.abort()
+        raise
+    if not chunks:
+        return pd.DataFrame(columns=spec['columns']), header
+    return pd.concat(chunks, ignore_index=True), header
+
+
+class _TailRecorder:
+    """File-like wrapper that remembers the last `TAIL_BYTES` read through it."""
+
+    def __init__(self, body):
+        self.body = body
+        self.total = 0
+        self._tail = b''
+
+    def read(self, size=-1):
+        data = self.body.read(size)
+        self.total += len(data)
+        self._tail = (self._tail + data)[-TAIL_BYTES:]
+        return data
+
+    def last_line(self):
+        """The last complete line read (with its newline), or None if it didn't fit or wasn't terminated."""
+        if not self._tail.endswith(b'\n'):
+            return None
+        start = self._tail.rfind(b'\n', 0, len(self._tail) - 1)
+        if start < 0 and self.total > len(self._tail):
+            return None
+        return self._tail[start + 1:]
+
+
+def _get_if_match(s3_client, spec, etag, start):
+    # None when the object changed between HEAD and GET; the caller falls back to a full read
+    with timed('s3 get_object (range)') as stats:
+        try:
+            response = s3_client.get_object(Bucket=BUCKET, Key=spec['key'], Range=f"bytes={start}-", IfMatch=etag)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('412', 'PreconditionFailed'):
+                return None
+            raise
+        stats['bytes'] = response.get('ContentLength')
+        return response
+
+
+def _read_tail(s3_client, spec, etag, size):
+    # Snapshots don't keep the raw bytes, so fetch the last line straight from S3
+    response = _get_if_match(s3_client, spec, etag, max(size - TAIL_BYTES, 0))
+    if response is None:
+        return None
+    recorder = _TailRecorder(response['Body'])
+    recorder.total = max(size - TAIL_BYTES, 0)
+    with timed('s3 get_object (range)'):
+        while recorder.read(TAIL_BYTES):
+            pass
+    return recorder.last_line()
+
+
+def _read_appended_tail(s3_client, spec, previous, head):
+    """Parse the rows appended since `previous`, or None if the ingested prefix no longer matches."""
+    # Re-read the last ingested line first: if it changed, rows were rewritten rather than appended
+    response = _get_if_match(s3_client, spec, head['ETag'], previous.size - len(previous.tail))
+    if response is None:
+        return None
+    body = response['Body']
+    if body.read(len(previous.tail)) != previous.tail:
+        body.close()
+        return None
+    recorder = _TailRecorder(body)
+    delta, _ = read_csv_stream(recorder, spec, names=previous.header)
+    return delta, recorder.last_line()
+
+
+def _load_export(s3_client, spec, head, previous=None):
+    etag, size = head.get('ETag'), head.get('ContentLength')
+    if (spec.get('append_only') and previous is not None and previous.size and previous.header and previous.tail
+            and size is not None and size > previous.size
+            and time.monotonic() - previous.loaded_at < FULL_RELOAD_SECONDS):
+        appended = _read_appended_tail(s3_client, spec, previous, head)
+        if appended is not None:
+            delta, tail = appended
+            return previous.extend(delta, etag, size, tail)
+
+    tail = None
+    with timed('snapshot read') as stats:
+        df = read_snapshot(spec['key'], etag, spec['columns'])
+        stats['rows'] = len(df) if df is not None else 0
+    if df is not None:
+        header = pq.read_schema(_snapshot_path(spec['key'], etag)).names
+        if spec.get('append_only') and size:
+            tail = _read_tail(s3_client, spec, etag, size)
+    else:
+        with timed('s3 get_object') as stats:
+            response = s3_client.get_object(Bucket=BUCKET, Key=spec['key'])
+            stats['bytes'] = response.get('ContentLength')
+        etag, size = response.get('ETag'), response.get('ContentLength')
+        snapshot = SnapshotWriter(spec['key'], etag) if pq is not None and etag is not None else None
+        recorder = _TailRecorder(response['Body'])
+        df, header = read_csv_stream(recorder, spec, snapshot)
+        tail = recorder.last_line()
+    return Dataset(df, etag, spec, size, header, tail)
+
+
+def get_dataset(name, cache=None):
+    """Return the cached Dataset for an export registered in DATASETS, waiting for it if it is being prefetched."""
+    spec = DATASETS[name]
+    cache = cache or get_dataset_cache()
+    with timed(f'load: {name}') as stats:
+        dataset = cache.get(BUCKET, spec['key'], lambda s3_client, head, previous: _load_export(s3_client, spec, head, previous))
+        stats['rows'] = len(dataset.df)
+    return dataset
+
+
+@st.cache_resource
+def prefetch_datasets():
+    """Start downloading and parsing every export in parallel; runs once per process."""
+    cache = get_dataset_cache()
+    executor = ThreadPoolExecutor(max_workers=len(DATASETS), thread_name_prefix='prefetch')
+    futures = {name: executor.submit(get_dataset, name, cache) for name in DATASETS}
+    executor.shutdown(wait=False)
+    return futures
+
+
+REVENUE_ROLLUP_KEYS = ['day', 'customer_id', 'description', 'subscription']
+REVENUE_ROLLUP_DOLLARS = ['total_invoice_amount', 'net_amount', 'tax', 'fee']
+
+
+def build_revenue_rollup(df):
+    """Daily invoice totals keyed by day x customer x description x subscription, sorted by day.
+
+    Amounts are summed exactly in cents and converted to dollars once, on the
+    rolled-up rows.
+    """
+    day = df['created'].dt.floor('D').rename('day')
+    rollup = df.groupby([day, df['customer_id'], df['description'], df['subscription']], dropna=False, observed=True).agg(
+        total_invoice_amount=('total_invoice_amount', 'sum'),
+        net_amount=('net_amount', 'sum'),
+        tax=('tax', 'sum'),
+        fee=('fee', 'sum'),
+        transactions=('total_invoice_amount', 'count'),
+        rows=('created', 'size'),
+    ).reset_index()
+    for column in REVENUE_ROLLUP_DOLLARS:
+        rollup[column] = rollup[column].astype('float64') / 100
+    return rollup
+
+
+def to_dollars(df, spec):
+    """Copy of `df` with the spec's cents columns converted back to dollars for display."""
+    cents = [column for column in spec.get('schema', {}).get('cents', []) if column in df.columns]
+    return df.assign(**{column: df[column].astype('float64') / 100 for column in cents})
+
+
+def extend_revenue_rollup(rollup, delta):
+    """The revenue rollup with appended invoice rows folded in."""
+    return merge_daily_rollup(rollup, build_revenue_rollup(delta), REVENUE_ROLLUP_KEYS, REVENUE_ROLLUP_DOLLARS)
+
+
+def merge_daily_rollup(rollup, delta_rollup, keys, dollars=()):
+    """Fold the rollup of some appended rows into a rollup sorted by day.
+
+    Only the rows from the first day the delta touches onwards are regrouped;
+    earlier days are kept as they are. `dollars` columns are re-summed in cents
+    so the result matches a rollup built from scratch.
+    """
+    for column in keys:
+        if isinstance(delta_rollup[column].dtype, pd.CategoricalDtype):
+            categories = rollup[column].cat.categories.union(delta_rollup[column].cat.categories, sort=False)
+            if len(categories) != len(rollup[column].cat.categories):
+                rollup = rollup.assign(**{column: rollup[column].cat.set_categories(categories)})
+            delta_rollup = delta_rollup.assign(**{column: delta_rollup[column].cat.set_categories(categories)})
+    first_day = delta_rollup['day'].min()
+    split = rollup['day'].searchsorted(first_day) if pd.notna(first_day) else int(rollup['day'].notna().sum())
+    touched = pd.concat([rollup.iloc[split:], delta_rollup], ignore_index=True)
+    for column in dollars:
+        touched[column] = (touched[column] * 100).round().astype('int64')
+    merged = touched.groupby(keys, dropna=False, observed=True).sum().reset_index()
+    for column in dollars:
+        merged[column] = merged[column].astype('float64') / 100
+    return pd.concat([rollup.iloc[:split], merged[rollup.columns]], ignore_index=True)
+
+
+def table_positions(df, sort_by=None, descending=False, filter_column=None, contains='', spec=None):
+    """Row positions of `df` after an optional substring filter and sort, without copying the frame.
+
+    With a `spec`, its cents columns are searched as the dollars the table shows.
+    """
+    positions = None
+    if filter_column and contains:
+        values = df[filter_column] if spec is None else to_dollars(df[[filter_column]], spec)[filter_column]
+        mask = values.astype('string').str.contains(contains, case=False, regex=False, na=False)
+        positions = np.flatnonzero(mask.to_numpy())
+    if sort_by:
+        column = df[sort_by] if positions is None else df[sort_by].iloc[positions]
+        order = column.reset_index(drop=True).sort_values(ascending=not descending, kind='stable').index.to_numpy()
+        positions = order if positions is None else positions[order]
+    return positions
+
+
+@st.fragment
+def view_data(df, default, spec=None, dates=(), dataset=None, window=None, name='table'):
+    """The "VIEW DATA" expander, paginated: only the visible page of the chosen columns is sent to the browser.
+
+    Sorting and filtering happen here on row positions. When `df` is the (start, end) `window` of
+    `dataset`, the positions are cached under `name`, so paging doesn't sort the window again.
+    `dates` are timestamp columns shown as plain dates, converted on the visible page only. Any
+    change reruns only this fragment, not the page.
+    """
+    with st.expander("VIEW DATA"):
+        showData = st.multiselect('Filter: ', df.columns, default=default)
+        sort_col, order_col, filter_col, contains_col = st.columns([2, 1, 2, 2])
+        sort_by = sort_col.selectbox('Sort by', [None, *showData], format_func=lambda column: column or '(file order)')
+        descending = order_col.checkbox('Descending')
+        filter_column = filter_col.selectbox('Search column', [None, *showData], format_func=lambda column: column or '(none)')
+        contains = contains_col.text_input('Contains', disabled=filter_column is None)
+
+        build = lambda: table_positions(df, sort_by, descending, filter_column, contains, spec)
+        if dataset is not None and window is not None and (sort_by or (filter_column and contains)):
+            table_key = f'{name}: {sort_by} {descending} {filter_column} {contains}'
+            positions = get_table_cache().get(dataset, *window, table_key, build)
+        else:
+            positions = build()
+        total = len(df) if positions is None else len(positions)
+        size_col, page_col = st.columns([1, 1])
+        page_size = size_col.selectbox('Rows per page', TABLE_PAGE_SIZES)
+        pages = max(1, -(-total // page_size))
+        page = page_col.number_input(f'Page (of {pages:,})', min_value=1, max_value=pages, value=1)
+
+        start = (page - 1) * page_size
+        stop = min(start + page_size, total)
+        rows = df.iloc[start:stop] if positions is None else df.iloc[positions[start:stop]]
+        selection = rows[showData]
+        selection = selection.assign(**{column: selection[column].dt.date for column in dates if column in showData})
+        st.dataframe(to_dollars(selection, spec) if spec is not None else selection, use_container_width=True)
+        st.caption(f"Rows {start + 1 if total else 0:,}–{stop:,} of {total:,}")
+
+
+def revenue_kpis(rollup):
+    """The Revenue page's headline numbers for a window of the daily revenue rollup, in dollars.
+
+    All measures are summed in one pass over the rollup's columns; subscriptions
+    sold count the invoice lines whose subscription is set, via a mask rather
+    than a filtered copy.
+    """
+    with timed('aggregate: revenue KPIs', rows=len(rollup)):
+        totals = rollup[['total_invoice_amount', 'net_amount', 'fee', 'tax', 'transactions']].sum()
+        subscribed = rollup['subscription'].notna().to_numpy()
+        return {
+            'total_amount': totals['total_invoice_amount'],
+            'total_transactions': int(totals['transactions']),
+            'total_net_amount': totals['net_amount'],
+            'total_fee_amount': totals['fee'],
+            'total_subscriptions_sold': int(rollup['rows'].to_numpy()[subscribed].sum()),
+            'total_tax': totals['tax'],
+        }
+
+
+# Revenue chart aggregates. Each takes a window of the daily revenue rollup and
+# returns the finished frame the chart plots, since results are cached and shared
+
+def _year_month(rollup):
+    return rollup['day'].dt.to_period('M').rename('year_month')
+
+
+def monthly_net_amount_by_month(rollup):
+    with timed('groupby: monthly net amount', rows=len(rollup)):
+        monthly_net_amount = rollup.groupby(_year_month(rollup))['net_amount'].sum().reset_index()
+    monthly_net_amount['year_month'] = monthly_net_amount['year_month'].astype(str)
+    return monthly_net_amount
+
+
+def monthly_tax_by_month(rollup):
+    with timed('groupby: monthly tax', rows=len(rollup)):
+        monthly_tax = rollup.groupby(_year_month(rollup))['tax'].sum().reset_index()
+    monthly_tax['year_month'] = monthly_tax['year_month'].astype(str)
+    return monthly_tax
+
+
+def top_k(rollup, key, value, k=10):
+    """The `k` keys with the largest summed `value`, largest first.
+
+    Groups without sorting the keys and picks the top with a partial selection
+    (nlargest), so nothing is fully sorted however many distinct keys there are.
+    """
+    totals = rollup.groupby(key, sort=False, observed=True)[value].sum()
+    return totals.nlargest(k).reset_index()
+
+
+def top_customers_by_revenue(rollup):
+    with timed('groupby: top customers', rows=len(rollup)):
+        return top_k(rollup, 'customer_id', 'total_invoice_amount')
+
+
+def top_products_by_revenue(rollup):
+    with timed('groupby: top products', rows=len(rollup)):
+        return top_k(rollup, 'description', 'total_invoice_amount')
+
+
+def tax_and_fee_by_month(rollup):
+    with timed('groupby: monthly tax and fee', rows=len(rollup)):
+        tax_fee = rollup.groupby(_year_month(rollup)).agg({'tax': 'sum', 'fee': 'sum'}).reset_index()
+    tax_fee = tax_fee.rename(columns={'year_month': 'month'})
+    tax_fee['month'] = tax_fee['month'].astype(str)
+    return tax_fee
+
+
+def subscription_counts(rollup):
+    with timed('groupby: subscriptions', rows=len(rollup)):
+        subscription_analysis = rollup.groupby('subscription', observed=True)['rows'].sum().sort_values(ascending=False).reset_index()
+    subscription_analysis.columns = ['Subscription', 'Count']
+    return subscription_analysis
+
+
+def build_signup_trend(df):
+    """Customers created per day, and how many of those are now deleted, sorted by day."""
+    day = df['created'].dt.floor('D').rename('day')
+    return pd.DataFrame({
+        'new_customers': df.groupby(day).size(),
+        'churned': df['deleted'].eq(True).groupby(day).sum(),
+    }).reset_index()
+
+
+def monthly_signups(signups):
+    """Roll a window of the daily sign-up store up to months labelled 'YYYY-MM', oldest first.
+
+    Months without sign-ups between the first and last are included as zeros.
+    """
+    with timed('groupby: sign-ups by month', rows=len(signups)):
+        month = signups['day'].dt.to_period('M').rename('month')
+        monthly = signups.groupby(month)[['new_customers', 'churned']].sum()
+        if len(monthly):
+            monthly = monthly.reindex(pd.period_range(monthly.index.min(), monthly.index.max(), freq='M', name='month'),
+                                      fill_value=0)
+        monthly = monthly.reset_index()
+    monthly['month'] = monthly['month'].astype(str)
+    return monthly
+
+
+def build_geo_rollup(df):
+    """Customers per sign-up day x shipping country x shipping city, sorted by day."""
+    day = df['created'].dt.floor('D').rename('day')
+    keys = [day, df['shipping_address_country'], df['shipping_address_city']]
+    return df.groupby(keys, dropna=False, observed=True).size().rename('customers').reset_index()
+
+
+def geo_counts(geo, by, require=None, country=None):
+    """Customers per `by` in a window of the geo rollup, most first, ignoring missing values.
+
+    `require` also drops rows missing that column; `country` restricts to one country.
+    """
+    with timed(f'groupby: customers by {by}', rows=len(geo)):
+        mask = geo[by].notna()
+        if require is not None:
+            mask &= geo[require].notna()
+        if country is not None:
+            mask &= geo['shipping_address_country'] == country
+        counts = geo.loc[mask].groupby(by, observed=True)['customers'].sum()
+        return counts[counts > 0].sort_values(ascending=False, kind='stable').reset_index()
+
+
+@st.fragment
+def geo_drilldown(geo, countries):
+    """Cities within one chosen country; changing the country reruns only this fragment."""
+    if not countries:
+        return
+    country = st.selectbox('Cities in country', countries)
+    city_counts = geo_counts(geo, 'shipping_address_city', country=country)
+    city_counts.columns = ['City', 'Count']
+    fig = build_figure(px.bar, city_counts.head(10), x='City', y='Count', title=f'Top 10 Cities in {country}')
+    plotly_chart(fig)
+
+
+PAYMENT_ROLLUP_KEYS = ['day', 'status', 'failure_code', 'refunded', 'description', 'refunded_amount']
+
+
+def build_payment_rollup(df):
+    """Payments per day x status x failure code x refunded x description x refunded amount, sorted by day.
+
+    The refunded amount key is 0 for payments with nothing refunded.
+    """
+    refunded_amount = df['amount_refunded'].where(df['amount_refunded'] > 0, 0).rename('refunded_amount')
+    keys = [df['created_date'].dt.floor('D').rename('day'), df['status'], df['failure_code'],
+            df['refunded'].eq(True).rename('refunded'), df['description'], refunded_amount]
+    return df.groupby(keys, dropna=False, observed=True).size().rename('payments').reset_index()
+
+
+def extend_payment_rollup(rollup, delta):
+    """The payment rollup with appended payment rows folded in."""
+    return merge_daily_rollup(rollup, build_payment_rollup(delta), PAYMENT_ROLLUP_KEYS)
+
+
+def payment_summary(rollup):
+    """Every breakdown the Payment page shows, from a window of the daily payment rollup.
+
+    Counts are sorted most first, like value_counts, and failure shares are of
+    the payments that have a failure code.
+    """
+    def counts(by, mask=None):
+        payments = rollup['payments'] if mask is None else rollup['payments'][mask]
+        keys = rollup[by] if mask is None else rollup[by][mask]
+        totals = payments.groupby(keys, observed=True).sum()
+        return totals[totals > 0].sort_values(ascending=False, kind='stable').rename('count')
+
+    with timed('aggregate: payment summary', rows=len(rollup)):
+        failures = counts('failure_code')
+        refund_amounts = counts('refunded_amount', rollup['refunded_amount'] > 0)
+        return {
+            'total': int(rollup['payments'].sum()),
+            'status_counts': counts('status'),
+            'failure_shares': (failures / failures.sum()).rename('proportion'),
+            'refunded_items': counts('description', rollup['refunded']),
+            'refund_amounts': refund_amounts.rename_axis('amount_refunded'),
+        }
+
+
+CUSTOMER_DISPLAY_COLUMNS = ['name', 'phone', 'email', 'address_country']
+
+
+def build_customer_lookup(df):
+    """Customer display columns indexed by customer id, first row per id."""
+    lookup = df[['id', *CUSTOMER_DISPLAY_COLUMNS]].dropna(subset=['id']).drop_duplicates(subset='id')
+    return lookup.set_index('id')
+
+
+def join_customers(df, lookup, on='customer_id'):
+    """Inner join of `df` with a customer lookup; costs O(len(df)) however many customers there are."""
+    with timed('join: customer lookup', rows=len(df)):
+        positions = lookup.index.get_indexer(df[on])
+        found = positions >= 0
+        customers = lookup.iloc[positions[found]].reset_index()
+        return pd.concat([df[found].reset_index(drop=True), customers], axis=1)
+
+
+def status_summary(status):
+    """Subscription counts per status from a single count over the column.
+
+    'counts' holds the statuses that occur, most common first; 'inactive' is
+    every row that isn't active, missing statuses included.
+    """
+    with timed('value_counts: subscription status', rows=len(status)):
+        counts = status.value_counts()
+    counts = counts[counts > 0]
+    return {'counts': counts, 'total': len(status), 'inactive': len(status) - int(counts.get('active', 0))}
+
+
+# Finest first: (pandas period frequency, label, approximate days per bucket)
+TIME_BUCKETS = [('D', 'Daily', 1), ('W', 'Weekly', 7), ('M', 'Monthly', 30.44), ('Q', 'Quarterly', 91.31), ('Y', 'Yearly', 365.25)]
+
+
+def time_bucket(start_date, end_date, max_points=CHART_MAX_POINTS, finest='D'):
+    """The finest (frequency, label) no finer than `finest` that covers the window in at most `max_points` buckets."""
+    days = (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days + 1
+    buckets = TIME_BUCKETS[[freq for freq, _, _ in TIME_BUCKETS].index(finest):]
+    for freq, label, bucket_days in buckets:
+        if days / bucket_days <= max_points:
+            return freq, label
+    return buckets[-1][:2]
+
+
+def downsample(df, column, values, freq, how='sum'):
+    """Aggregate `values` into `freq` buckets of the datetime `column`, labelled by each bucket's start."""
+    bucket = df[column].dt.to_period(freq).dt.start_time.rename(column)
+    with timed(f'downsample: {column} by {freq}', rows=len(df)):
+        return df.groupby(bucket)[values].agg(how).reset_index()
+
+
 # Class definition for the dashboard
 class Dashboard:
-    def __init__(self, data):
-        self.data = data
-        self.df = pd.read_csv(StringIO(self.data))
-        self.df["created"] = pd.to_datetime(self.df["created"])
+    def __init__(self, cache=None):
+        # Datasets are loaded the first time a page asks for them, so opening
+        # Financial doesn't wait on the invoice export
+        self._cache = cache
+        self._datasets = {}
     #def style_metric_cards(self, background_color="#333333", border_left_color="#444444", border_color="#555555", box_shadow="#000000"):
         st.markdown(
             f"""
@@ -65,8 +1358,24 @@ class Dashboard:
             )
     
 
+
+    def data(self, name):
+        """The Dataset registered as `name`, loaded on first use and reused for the rest of the run."""
+        if name not in self._datasets:
+            self._datasets[name] = get_dataset(name, self._cache)
+        return self._datasets[name]
+
+    @property
+    def dataset(self):
+        return self.data('invoices')
+
+    @property
+    def df(self):
+        return self.dataset.df
+
     def revenue(self):
-        df_selection = self._get_filtered_data()
+        start_date, end_date = self._get_date_range()
+        df_selection = self._get_filtered_data(start_date, end_date)
         st.markdown(
                 """
                 <style>
@@ -79,37 +1388,42 @@ class Dashboard:
             )
     
 
-        with st.expander("VIEW DATA"):
-            showData = st.multiselect('Filter: ', df_selection.columns, default=[
-                'created', 'customer_id', 'email', 'phone', 'name',  'subscription', 'invoice_number',
-                'description', 'quantity', 'currency', 'line_item_amount',
-                'total_invoice_amount', 'discount', 'fee', 'tax', 'net_amount'
-            ])
-            st.dataframe(df_selection[showData], use_container_width=True)
-
-        total_amount = df_selection['total_invoice_amount'].sum()
-        total_transactions = df_selection["total_invoice_amount"].count() # Total transaction
-        total_net_amount = df_selection["net_amount"].sum() # Total net Amount
-        total_fee_amount = df_selection["fee"].sum() # Total fee amount
-        total_subscriptions_sold = df_selection.dropna(subset=["subscription"]).shape[0] # Total subscriptions sold (monthly, yearly)
-        total_tax = df_selection["tax"].sum() # Total tax
+        view_data(df_selection, default=[
+            'created', 'customer_id', 'email', 'phone', 'name',  'subscription', 'invoice_number',
+            'description', 'quantity', 'currency', 'line_item_amount',
+            'total_invoice_amount', 'discount', 'fee', 'tax', 'net_amount'
+        ], spec=self.dataset.spec, dataset=self.dataset, window=(start_date, end_date))
+
+        kpis = self._rollup_aggregate('revenue KPIs', start_date, end_date, revenue_kpis)
 
         # Display metrics
-        self._display_metrics(total_tax, total_net_amount, total_fee_amount, total_transactions, total_subscriptions_sold, total_amount)
+        self._display_metrics(**kpis)
 
         # Visualizations
-        self._create_charts(df_selection)
+        self._create_charts(start_date, end_date)
 
     #self.style_metric_cards()
 
-    def _get_filtered_data(self):
+    def _get_date_range(self):
         start_date = st.sidebar.date_input("Start date", self.df["created"].min())
         end_date = st.sidebar.date_input("End date", self.df["created"].max())
 
-        start_date = pd.to_datetime(start_date)
-        end_date = pd.to_datetime(end_date)
+        return pd.to_datetime(start_date), pd.to_datetime(end_date)
+
+    def _get_filtered_data(self, start_date, end_date):
+        return self.dataset.window(start_date, end_date)
+
+    def _get_rollup(self, start_date, end_date):
+        rollup = self.dataset.derived('revenue_rollup', build_revenue_rollup, extend_revenue_rollup)
+        return slice_window(rollup, 'day', start_date, end_date)
+
+    def _aggregate(self, name, start_date, end_date, build, dataset=None):
+        # Shared across sessions: identical windows on the same export version are computed once
+        dataset = self.dataset if dataset is None else dataset
+        return get_aggregate_cache().get(dataset, start_date, end_date, name, build)
 
-        return self.df.query("created >= @start_date and created <= @end_date")
+    def _rollup_aggregate(self, name, start_date, end_date, build):
+        return self._aggregate(name, start_date, end_date, lambda: build(self._get_rollup(start_date, end_date)))
 
     def _display_metrics(self, total_tax, total_net_amount, total_fee_amount, total_transactions, total_subscriptions_sold, total_amount):
         total1, total2, total3 = st.columns(3, gap='small')
@@ -142,68 +1456,70 @@ class Dashboard:
             st.metric(label="Total Subscriptions Sold", value=f"{total_subscriptions_sold:,}")
         
 
-    def _create_charts(self, df_selection):
-        df_selection['year_month'] = df_selection['created'].dt.to_period('M')
-
-        # Group by 'year_month' and sum the 'net_amount'
-        monthly_net_amount = df_selection.groupby('year_month')['net_amount'].sum().reset_index()
-        monthly_net_amount['year_month'] = monthly_net_amount['year_month'].astype(str)
-        fig = px.bar(monthly_net_amount, x='year_month', y='net_amount', title="Total Net Amount by Month",
+    def _create_charts(self, start_date, end_date):
+        # All charts are answered from the daily rollup rather than the invoice lines, and
+        # their results come from the shared aggregate cache
+        self._monthly_charts(start_date, end_date)
+        self._top_customers_chart(start_date, end_date)
+        self._top_products_chart(start_date, end_date)
+        self._tax_fee_chart(start_date, end_date)
+        self._subscription_chart(start_date, end_date)
+
+    def _monthly_charts(self, start_date, end_date):
+        # Group by month and sum the 'net_amount'
+        monthly_net_amount = self._rollup_aggregate('monthly net amount', start_date, end_date, monthly_net_amount_by_month)
+        fig = build_figure(px.bar, monthly_net_amount, x='year_month', y='net_amount', title="Total Net Amount by Month",
                     labels={'year_month': 'Month', 'net_amount': 'Total Net Amount ($)'})
         
-        # Group by 'year_month' and sum the 'tax'
-        monthly_tax = df_selection.groupby('year_month')['tax'].sum().reset_index()
-        monthly_tax['year_month'] = monthly_tax['year_month'].astype(str)
-        fig_2 = px.pie(monthly_tax, values='tax', names='year_month', title="Total Tax by Month",
+        # Group by month and sum the 'tax'
+        monthly_tax = self._rollup_aggregate('monthly tax', start_date, end_date, monthly_tax_by_month)
+        fig_2 = build_figure(px.pie, monthly_tax, values='tax', names='year_month', title="Total Tax by Month",
                     labels={'year_month': 'Month', 'tax': 'Total Tax ($)'})
 
         total1, total2 = st.columns(2, gap='small')
         with total1:
-            st.plotly_chart(fig)
+            plotly_chart(fig)
 
         with total2:
-            st.plotly_chart(fig_2)
+            plotly_chart(fig_2)
 
-        df_selection['total_invoice_amount'] = df_selection['total_invoice_amount'].astype(int)
-        top_customers = df_selection.groupby('customer_id')['total_invoice_amount'].sum().reset_index()
-        top_customers = top_customers.sort_values(by='total_invoice_amount', ascending=False).head(10)
-        fig = px.bar(top_customers, x='customer_id', y='total_invoice_amount', title='Top 10 Customers by Revenue')
-        st.plotly_chart(fig)
+    def _top_customers_chart(self, start_date, end_date):
+        top_customers = self._rollup_aggregate('top customers', start_date, end_date, top_customers_by_revenue)
+        fig = build_figure(px.bar, top_customers, x='customer_id', y='total_invoice_amount', title='Top 10 Customers by Revenue')
+        plotly_chart(fig)
 
         with st.expander("VIEW DATA"):
             st.dataframe(top_customers)
 
-        revenue_by_product = df_selection.groupby('description')['total_invoice_amount'].sum().reset_index()
-        # Sort the values and get the top 10
-        top_revenue_by_product = revenue_by_product.sort_values(by='total_invoice_amount', ascending=False).head(10)
+    def _top_products_chart(self, start_date, end_date):
+        top_revenue_by_product = self._rollup_aggregate('top products', start_date, end_date, top_products_by_revenue)
         # Create the treemap visualization
-        fig = px.treemap(top_revenue_by_product, path=['description'], values='total_invoice_amount', title='Top 10 Products by Revenue')
-        st.plotly_chart(fig)
+        fig = build_figure(px.treemap, top_revenue_by_product, path=['description'], values='total_invoice_amount', title='Top 10 Products by Revenue')
+        plotly_chart(fig)
 
         with st.expander("VIEW DATA"):
             st.dataframe(top_revenue_by_product)
 
-        df_selection['month'] = df_selection['created'].dt.to_period('M').astype(str)
-        tax_fee = df_selection.groupby('month').agg({'tax': 'sum', 'fee': 'sum'}).reset_index()
-        fig = px.bar(tax_fee, x='month', y=['tax', 'fee'], title='Tax and Fee Analysis Over Time')
-        st.plotly_chart(fig)
+    def _tax_fee_chart(self, start_date, end_date):
+        tax_fee = self._rollup_aggregate('monthly tax and fee', start_date, end_date, tax_and_fee_by_month)
+        fig = build_figure(px.bar, tax_fee, x='month', y=['tax', 'fee'], title='Tax and Fee Analysis Over Time')
+        plotly_chart(fig)
 
         with st.expander("VIEW DATA"):
             st.dataframe(tax_fee)
 
-        subscription_analysis = df_selection['subscription'].value_counts().reset_index()
-        subscription_analysis.columns = ['Subscription', 'Count']
-        fig = px.bar(subscription_analysis, x='Subscription', y='Count', title='Revenue by Subscription')
-        st.plotly_chart(fig)
+    def _subscription_chart(self, start_date, end_date):
+        subscription_analysis = self._rollup_aggregate('subscriptions', start_date, end_date, subscription_counts)
+        fig = build_figure(px.bar, subscription_analysis, x='Subscription', y='Count', title='Revenue by Subscription')
+        plotly_chart(fig)
 
         with st.expander("VIEW DATA"):
             st.dataframe(subscription_analysis)
-    def Customers(*args):
+
+    def Customers(self):
         # Load customer data from the customers.csv file
-        s3_client = boto3.client('s3')
-        response2 = s3_client.get_object(Bucket='stripe-raw-data-dashboard', Key='customers_6months.csv')
-        content2 = response2['Body'].read().decode('utf-8')
-        customers= pd.read_csv(StringIO(content2))
+        customers_dataset = self.data('customers')
+        customers = customers_dataset.df
 
         st.markdown(
                 """
@@ -218,68 +1534,61 @@ class Dashboard:
     
 
         st.sidebar.header("Select Date Range:")
-        customers['created'] = pd.to_datetime(customers['created'], errors='coerce')
 
         start_date = st.sidebar.date_input("Start date", customers["created"].min().date())
         end_date = st.sidebar.date_input("End date", customers["created"].max().date())
 
         # Filter data
-        filtered_df = customers[(customers['created'] >= pd.to_datetime(start_date)) & (customers['created'] <= pd.to_datetime(end_date))]
+        filtered_df = customers_dataset.window(start_date, end_date)
 
         # Customer churn analysis
         st.subheader("Customer Retention and Churn Analysis")
+        # Sign-up and churn counts come from the per-day store built once per customers version
+        signups = customers_dataset.derived('signup_trend', build_signup_trend)
+        window_signups = slice_window(signups, 'day', start_date, end_date)
         total_customers = filtered_df.shape[0]
-        churned_customers = filtered_df['deleted'].sum()  # Assuming 'deleted' is a boolean for churned customers
-        churn_rate = churned_customers / total_customers * 100
+        churned_customers = window_signups['churned'].sum()  # Assuming 'deleted' is a boolean for churned customers
+        churn_rate = churned_customers / total_customers * 100 if total_customers else 0
         
         # Display churn rate in metrics
-        # st.metric("Total Customers", total_customers)
-        # st.metric("Churned Customers", churned_customers)
-        # st.metric("Churn Rate", f"{churn_rate:.2f}%")
-
-        # total1, total2, total3 = st.columns(3, gap='small')
-        # with total1:
-        st.info('Total Customers')
-        st.metric(label="Total Customers", value=f" {total_customers:,.0f}")
-
-        # with total2:
-        #     st.info('Churned Customers')
-        #     st.metric(label="Churned Customers", value=f"{churned_customers:.2f}")
-
-        # with total3:
-        #     st.info('Churn Rate')
-        #     st.metric(label="Churn Rate", value=f"{churn_rate:.2f}%")
-        
-        with st.expander("VIEW DATA"):
-            filtered_df['created'] = pd.to_datetime(filtered_df['created']).dt.date
+        total1, total2, total3 = st.columns(3, gap='small')
+        with total1:
+            st.info('Total Customers')
+            st.metric(label="Total Customers", value=f" {total_customers:,.0f}")
 
-            showData = st.multiselect('Filter: ', filtered_df.columns, default=[
-                'created',  'email', 'phone', 'name',"address_country"])
-            st.dataframe(filtered_df[showData], use_container_width=True)
+        with total2:
+            st.info('Churned Customers')
+            st.metric(label="Churned Customers", value=f"{churned_customers:,.0f}")
 
+        with total3:
+            st.info('Churn Rate')
+            st.metric(label="Churn Rate", value=f"{churn_rate:.2f}%")
+
+        # Rolling cohort retention, kept up to date incrementally across reruns and sessions
+        cohort_rates = get_retention_store().rates(customers_dataset, self.data('subscriptions'), start_date, end_date)
+        if not cohort_rates.empty:
+            fig = build_figure(px.imshow, cohort_rates, text_auto=True, aspect='auto', color_continuous_scale='Blues',
+                               labels={'x': 'Months since sign-up', 'y': 'Sign-up cohort', 'color': 'Retained (%)'},
+                               title='Cohort Retention (subscribed at this age or later)')
+            plotly_chart(fig)
+            with st.expander("VIEW DATA"):
+                st.dataframe(cohort_rates)
+        
+        view_data(filtered_df, default=[
+            'created',  'email', 'phone', 'name',"address_country"], dates=['created'],
+            dataset=customers_dataset, window=(start_date, end_date))
 
-        # Convert 'created' to datetime if it's not already
-        customers['created'] = pd.to_datetime(customers['created'])
 
-        # Filter data for the last 6 months
+        # Count new customers per month over the last 6 months
         current_date = pd.to_datetime("today")
-        start_date = current_date - pd.DateOffset(months=6)
-        filtered_customers = customers[customers['created'] >= start_date]
-
-        # Group by month and count new customers
-        filtered_customers.set_index('created', inplace=True)
-        monthly_new_customers = filtered_customers.resample('M').size().reset_index(name='new_customers_count')
-
-        # Correctly align data with the months
-        monthly_new_customers['year_month'] = monthly_new_customers['created'].dt.strftime('%Y-%m')
-
-        # Sort by 'year_month' in ascending order
-        monthly_new_customers = monthly_new_customers.sort_values(by='created', ascending=True)
+        recent_signups = slice_window(signups, 'day', current_date - pd.DateOffset(months=6), current_date)
+        monthly_new_customers = monthly_signups(recent_signups).rename(
+            columns={'month': 'year_month', 'new_customers': 'new_customers_count'})
 
         st.subheader('New Customer Sign-Up Trend')
 
         # Plot the data
-        fig = px.bar(
+        fig = build_figure(px.bar,
             monthly_new_customers,
             x='year_month',
             y='new_customers_count',
@@ -297,29 +1606,24 @@ class Dashboard:
             bargroupgap=0.1
         )
 
-        st.plotly_chart(fig)
+        plotly_chart(fig)
 
         
-        # Filter data for the last 6 months
-        df_sign_up = filtered_df[["id", "created"]]
-        df_sign_up["created"] = pd.to_datetime(df_sign_up["created"])
-        df_sign_up["Month_year"] = df_sign_up["created"].dt.strftime('%Y-%m')
-        df_sign_up = df_sign_up[["id", "Month_year"]]
-        df_sign_up["Cust_count_month"] = df_sign_up.groupby("Month_year")["id"].transform('count')
-        df_sign_up_data = df_sign_up[["Month_year", "Cust_count_month"]]
-        df_sign_up_data = df_sign_up_data.drop_duplicates()
-        df_sign_up_data = df_sign_up_data.sort_values(by=['Month_year'], ascending=False)
-        df_sign_up_data.reset_index(drop=True, inplace=True)
+        # Sign-ups per month over the selected window, newest first
+        df_sign_up_data = monthly_signups(window_signups).rename(
+            columns={'month': 'Month_year', 'new_customers': 'Cust_count_month', 'churned': 'Churned_count_month'})
+        df_sign_up_data = df_sign_up_data.iloc[::-1].reset_index(drop=True)
         with st.expander("VIEW DATA"):
             st.dataframe(df_sign_up_data) #, use_container_width=True
                 
     
-        geo_data = filtered_df[['shipping_address_city', 'shipping_address_country']].dropna()
-        city_counts = geo_data['shipping_address_city'].value_counts().reset_index()
+        # City and country counts are summed from the day x country x city rollup, not the customer rows
+        geo = slice_window(customers_dataset.derived('geo_rollup', build_geo_rollup), 'day', start_date, end_date)
+        city_counts = geo_counts(geo, 'shipping_address_city', require='shipping_address_country')
         city_counts.columns = ['City', 'Count']
 
-        fig = px.bar(city_counts.head(10), x='City', y='Count', title='Top 10 Cities by Customer Count')
-        st.plotly_chart(fig)
+        fig = build_figure(px.bar, city_counts.head(10), x='City', y='Count', title='Top 10 Cities by Customer Count')
+        plotly_chart(fig)
     
 #################################################################################################
         
@@ -327,32 +1631,30 @@ class Dashboard:
 
 
         # Display an interactive table
-        city_counts = filtered_df['shipping_address_city'].value_counts().reset_index()
+        city_counts = geo_counts(geo, 'shipping_address_city')
         city_counts.columns = ['City', 'Count']
         with st.expander("VIEW DATA"):
             st.dataframe(city_counts)
 
         # Prepare data for the donut chart
-        country_counts = filtered_df['shipping_address_country'].value_counts().reset_index()
+        country_counts = geo_counts(geo, 'shipping_address_country')
         country_counts.columns = ['Country', 'Count']
 
-        fig = px.pie(country_counts.head(5), values='Count', names='Country', title='Top 5 Countries by Customer Count', hole=0.4)
+        fig = build_figure(px.pie, country_counts.head(5), values='Count', names='Country', title='Top 5 Countries by Customer Count', hole=0.4)
 
         fig.update_traces(textinfo='percent+label')
         fig.update_layout(annotations=[dict(text='Countries', x=0.5, y=0.5, font_size=20, showarrow=False)])
-        st.plotly_chart(fig)
+        plotly_chart(fig)
+
+        geo_drilldown(geo, country_counts['Country'].tolist())
 
 
 
 
-    def subscriptions(*args):
-        s3_client = boto3.client('s3')
-        response1 = s3_client.get_object(Bucket='stripe-raw-data-dashboard', Key='subscriptions_6months.csv')
-        response2= s3_client.get_object(Bucket='stripe-raw-data-dashboard', Key='customers_6months.csv')
-        content1 = response1['Body'].read().decode('utf-8')
-        content2 = response2['Body'].read().decode('utf-8')
-        df_sub = pd.read_csv(StringIO(content1))
-        df_cust =  pd.read_csv(StringIO(content2))
+    def subscriptions(self):
+        sub_dataset = self.data('subscriptions')
+        df_sub = sub_dataset.df
+        customers_dataset = self.data('customers')
 
         st.markdown(
                 """
@@ -371,10 +1673,6 @@ class Dashboard:
         # df3['current_period_end'] = pd.to_datetime(df3['current_period_end'], errors='coerce')
 
 
-        # Convert 'trial_end' and 'created' to datetime
-        df_sub['trial_end'] = pd.to_datetime(df_sub['trial_end'])
-        df_sub['created'] = pd.to_datetime(df_sub['created'])
-
         # Sidebar filter for date range
         st.sidebar.header("Select Date Range:")
         start_date = st.sidebar.date_input("Start date", datetime.date.today() - datetime.timedelta(days=30))
@@ -383,8 +1681,11 @@ class Dashboard:
         end_date = pd.to_datetime(end_date)
 
         # Filter the subscription data
-        df_sub_end = df_sub[(df_sub["trial_end"] >= start_date) & (df_sub["trial_end"] <= end_date)]
-        df_cust_sub_end = df_sub_end.merge(df_cust, left_on="customer_id", right_on="id", how="inner")
+        df_sub_end = sub_dataset.window(start_date, end_date)
+        # Look the window's customers up in an index built once per customers version,
+        # instead of merging against the whole customers table on every rerun
+        customer_lookup = customers_dataset.derived('customer_lookup', build_customer_lookup)
+        df_cust_sub_end = join_customers(df_sub_end, customer_lookup)
 
 
         # # Active Subscriptions
@@ -394,12 +1695,14 @@ class Dashboard:
         # Select relevant columns for analysis
         df_sub_ch = df_sub[["customer_id", "trial_start", "trial_end", "status", "start_date"]]
         # Calculate the total number of active and inactive subscriptions
-        total_active = df_sub_end[df_sub_end["status"] == "active"].shape[0]
-        total_inactive = df_sub_end[df_sub_end["status"] != "active"].shape[0]
-        total_trialing = df_sub_end[df_sub_end["status"] == "trialing"].shape[0]
-        total_past_due = df_sub_end[df_sub_end["status"] == "past_due"].shape[0]
-        total_paused = df_sub_end[df_sub_end["status"] == "paused"].shape[0]
-        total_incomplete_expired = df_sub_end[df_sub_end["status"] == "incomplete_expired"].shape[0]
+        # One count over the window feeds both the metric cards and the distribution chart
+        status = status_summary(df_sub_end["status"])
+        total_active = status['counts'].get("active", 0)
+        total_inactive = status['inactive']
+        total_trialing = status['counts'].get("trialing", 0)
+        total_past_due = status['counts'].get("past_due", 0)
+        total_paused = status['counts'].get("paused", 0)
+        total_incomplete_expired = status['counts'].get("incomplete_expired", 0)
         
 
         # Create columns in Streamlit
@@ -436,42 +1739,41 @@ class Dashboard:
 
         # Display upcoming subscription end customers
         st.subheader("Upcoming Subscription End Customers")
-        with st.expander("VIEW DATA"):
-            df_cust_sub_end['trial_start'] = pd.to_datetime(df_sub['trial_start']).dt.date
-            df_cust_sub_end['trial_end'] = pd.to_datetime(df_sub['trial_end']).dt.date
-            showData = st.multiselect('Filter: ', df_cust_sub_end.columns, default=[
-                "name", "phone", "email", "trial_start","trial_end"])
-            st.dataframe(df_cust_sub_end[showData], use_container_width=True)
+        view_data(df_cust_sub_end, default=[
+            "name", "phone", "email", "trial_start","trial_end"], dates=["trial_start", "trial_end"],
+            dataset=sub_dataset, window=(start_date, end_date), name=f"expiring trials {customers_dataset.etag}")
         # st.dataframe(df_cust_sub_end[["name", "phone", "email", "trial_end"]])    
 
-        # Get the value counts of the 'status' column
-        status_counts = df_sub_end["status"].value_counts()
+        status_counts = status['counts']
 
         # Create a bar chart using Plotly
-        fig = px.bar(x=status_counts.index, y=status_counts.values,
+        fig = build_figure(px.bar, x=status_counts.index, y=status_counts.values,
                     title="Subscription Status Distribution",
                     labels={'x': 'Subscription Status', 'y': 'Count'})
 
         # Display the bar chart in the Streamlit app
-        st.plotly_chart(fig)
+        plotly_chart(fig)
 
 
         # Monthly Active Subscriptions
-        df_sub_end["month"] = df_sub_end["created"].dt.to_period('M').astype(str)
-        monthly_active_subs = df_sub_end.groupby("month")["customer_id"].count().reset_index()
-        fig_monthly = px.bar(monthly_active_subs, x="month", y="customer_id", title="Monthly Active Subscriptions")
-        st.plotly_chart(fig_monthly)
+        with timed('groupby: monthly active subscriptions', rows=len(df_sub_end)):
+            month = sub_dataset.period("created", "M", df_sub_end).rename("month")
+            monthly_active_subs = df_sub_end.groupby(month)["customer_id"].count().reset_index()
+        monthly_active_subs["month"] = monthly_active_subs["month"].astype(str)
+        fig_monthly = build_figure(px.bar, monthly_active_subs, x="month", y="customer_id", title="Monthly Active Subscriptions")
+        plotly_chart(fig_monthly)
 
         # Daily Active Subscriptions
-        df_sub_end["day"] = df_sub_end["created"].dt.strftime('%Y-%m-%d')
-        daily_active_subs = df_sub_end.groupby("day")["customer_id"].count().reset_index()
-        fig_daily = px.bar(daily_active_subs, x="day", y="customer_id", title="Daily Active Subscriptions")
+        # Daily for short windows, coarser buckets for long ones so the chart stays a bounded size
+        freq, label = time_bucket(start_date, end_date)
+        daily_active_subs = downsample(df_sub_end, "created", "customer_id", freq, how='count').rename(columns={"created": "day"})
+        fig_daily = build_figure(px.bar, daily_active_subs, x="day", y="customer_id", title=f"{label} Active Subscriptions")
         fig_daily.update_layout(
             xaxis_title='Date',
             yaxis_title='Number of Active Subscriptions',
             xaxis_tickformat='%Y-%m-%d'
         )
-        st.plotly_chart(fig_daily)
+        plotly_chart(fig_daily)
 
         
         # customer_id = "cus_OzTLZG52Io2Izb"
@@ -489,15 +1791,15 @@ class Dashboard:
         # st.plotly_chart(fig)
 
         # Filter the data for the specific customer_id
-        df_sub_end['trial_start'] = pd.to_datetime(df_sub_end['trial_start']).dt.date
-        df_sub_end['trial_end'] = pd.to_datetime(df_sub_end['trial_end']).dt.date
-        df_sub_end[df_sub_end["customer_id"]=="cus_OzTLZG52Io2Izb"][["customer_id","trial_start","trial_end","status"]].sort_values(by=["trial_start"])
+        customer_trials = df_sub_end[df_sub_end["customer_id"]=="cus_OzTLZG52Io2Izb"][["customer_id","trial_start","trial_end","status"]].sort_values(by=["trial_start"])
+        customer_trials = customer_trials.assign(trial_start=customer_trials['trial_start'].dt.date, trial_end=customer_trials['trial_end'].dt.date)
         with st.expander("VIEW DATA"):
-            st.dataframe(df_sub_end[df_sub_end["customer_id"]=="cus_OzTLZG52Io2Izb"][["customer_id","trial_start","trial_end","status"]].sort_values(by=["trial_start"]), use_container_width=True)
+            st.dataframe(customer_trials, use_container_width=True)
 
         
         # Count the number of times each customer has used the trial
-        df_trial_counts = df_sub_end["customer_id"].value_counts().reset_index()
+        with timed('value_counts: trials per customer', rows=len(df_sub_end)):
+            df_trial_counts = df_sub_end["customer_id"].value_counts().reset_index()
         df_trial_counts.columns = ['customer_id', 'trial_count']
 
         # Filter customers who have used the trial multiple times (e.g., more than once)
@@ -521,10 +1823,8 @@ class Dashboard:
 
 
     def payment(self):
-        s3_client = boto3.client('s3')
-        response = s3_client.get_object(Bucket='stripe-raw-data-dashboard', Key='both_success_fail.csv')
-        content = response['Body'].read().decode('utf-8')
-        payment_df = pd.read_csv(StringIO(content))
+        payment_dataset = self.data('payments')
+        payment_df = payment_dataset.df
 
         st.markdown(
                 """
@@ -538,13 +1838,12 @@ class Dashboard:
             )
         
         st.sidebar.header("Select Date Range:")
-        payment_df['created_date'] = pd.to_datetime(payment_df['created_date'], errors='coerce')
 
         start_date = st.sidebar.date_input("Start date", payment_df["created_date"].min().date())
         end_date = st.sidebar.date_input("End date", payment_df["created_date"].max().date())
 
         # Filter data
-        df2_filtered  = payment_df[(payment_df['created_date'] >= pd.to_datetime(start_date)) & (payment_df['created_date'] <= pd.to_datetime(end_date))]
+        df2_filtered = payment_dataset.window(start_date, end_date)
 
 
         if df2_filtered.empty:
@@ -552,17 +1851,19 @@ class Dashboard:
             return
         
 
-        with st.expander("VIEW DATA"):
-            df2_filtered['created_date'] = pd.to_datetime(df2_filtered['created_date']).dt.date
-            showData = st.multiselect('Filter: ', df2_filtered.columns, default=[
-                'id', 'amount', 'amount_refunded', 'balance_transaction_id',
-                'calculated_statement_descriptor',  'created_date', 'currency', 'customer_id',
-                'description', 'status'])
-            st.dataframe(df2_filtered[showData], use_container_width=True)
+        view_data(df2_filtered, default=[
+            'id', 'amount', 'amount_refunded', 'balance_transaction_id',
+            'calculated_statement_descriptor',  'created_date', 'currency', 'customer_id',
+            'description', 'status'], dates=['created_date'], dataset=payment_dataset, window=(start_date, end_date))
 
-        total_transactions = df2_filtered.shape[0]
-        successful_transactions = df2_filtered[df2_filtered["status"] == "succeeded"].shape[0]
-        failed_transactions = df2_filtered[df2_filtered["status"] == "failed"].shape[0]
+        # Every number on this page comes from one summary of the daily payment rollup
+        summary = self._aggregate('payment summary', start_date, end_date, lambda: payment_summary(
+            slice_window(payment_dataset.derived('payment_rollup', build_payment_rollup, extend_payment_rollup), 'day', start_date, end_date)),
+            dataset=payment_dataset)
+        status_counts = summary['status_counts']
+        total_transactions = summary['total']
+        successful_transactions = status_counts.get("succeeded", 0)
+        failed_transactions = status_counts.get("failed", 0)
 
         total1, total2, total3 = st.columns(3, gap='small')
         with total1:
@@ -581,18 +1882,16 @@ class Dashboard:
 
         total1, total2 = st.columns(2, gap='small')
         with total1:
-            refunded_line_items = df2_filtered[df2_filtered["refunded"] == True]["description"].value_counts()
+            refunded_line_items = summary['refunded_items']
             top_2 = refunded_line_items.head(2)
             other = refunded_line_items[2:].sum() if len(refunded_line_items) > 2 else 0
             top_2_with_other = pd.concat([top_2, pd.Series({'Other': other})])
 
-            fig = px.pie(values=top_2_with_other, names=top_2_with_other.index, title="Top 2 Refunded Line Items and Others",
+            fig = build_figure(px.pie, values=top_2_with_other, names=top_2_with_other.index, title="Top 2 Refunded Line Items and Others",
                         labels={'index': 'Refunded Items', 'values': 'Count'}, hole=0.3)
-            st.plotly_chart(fig)
+            plotly_chart(fig)
 
         with total2:
-            status_counts = df2_filtered['status'].value_counts()
-            
             if not status_counts.empty and 'succeeded' in status_counts and 'failed' in status_counts:
                 succeeded_count = status_counts['succeeded']
                 failed_count = status_counts['failed']
@@ -602,16 +1901,16 @@ class Dashboard:
                 values = [succeeded_count, failed_count]
                 
                 # Create a Plotly pie chart for payment statuses
-                fig = px.pie(values=values, names=labels, title="Payment Status Distribution",
+                fig = build_figure(px.pie, values=values, names=labels, title="Payment Status Distribution",
                             labels={'index': 'Payment Status', 'values': 'Count'}, hole=0.3)
-                st.plotly_chart(fig)
+                plotly_chart(fig)
             else:
                 st.write("No data available for succeeded or failed payments.")
 
-        failure_reasons = (df2_filtered["failure_code"].value_counts(normalize=True).head() * 100).round(2)
+        failure_reasons = (summary['failure_shares'].head() * 100).round(2)
         failure_reasons_df = failure_reasons.reset_index()
         failure_reasons_df.columns = ['Failure Reason', 'Percentage']
-        fig = px.bar(
+        fig = build_figure(px.bar,
             failure_reasons_df, 
             x='Failure Reason', 
             y='Percentage',
@@ -628,18 +1927,16 @@ class Dashboard:
             xaxis_tickangle=320,
             margin=dict(l=20, r=20, t=40, b=20),  # Adjust margins if needed
         )
-        st.plotly_chart(fig)
+        plotly_chart(fig)
 
 
-        refunded_amounts = df2_filtered[df2_filtered["amount_refunded"] > 0]["amount_refunded"].value_counts().head()
+        refunded_amounts = summary['refund_amounts'].head()
         st.subheader("Most Frequent Refunded Amounts")
         st.bar_chart(refunded_amounts,x_label="Amount Refunded", y_label="Count")
 
     def financial(self):
-        s3_client = boto3.client('s3')
-        response = s3_client.get_object(Bucket='stripe-raw-data-dashboard', Key='financial.csv')
-        content = response['Body'].read().decode('utf-8')
-        financial_df = pd.read_csv(StringIO(content))
+        financial_dataset = self.data('financial')
+        financial_df = financial_dataset.df
         st.markdown(
                 """
                 <style>
@@ -653,24 +1950,23 @@ class Dashboard:
 
         # Sidebar options
         st.sidebar.header("Select Date Range:")
-        financial_df['month'] = pd.to_datetime(financial_df['month'], errors='coerce')
 
         start_date = st.sidebar.date_input("Start date", financial_df["month"].min().date())
         end_date = st.sidebar.date_input("End date", financial_df["month"].max().date())
 
         # Filter data
-        filtered_df = financial_df[(financial_df['month'] >= pd.to_datetime(start_date)) & (financial_df['month'] <= pd.to_datetime(end_date))]
+        filtered_df = financial_dataset.window(start_date, end_date)
 
-        with st.expander("VIEW DATA"):
-            showData = st.multiselect('Filter: ',  filtered_df.columns, default=[
-                'month','currency','total_sales','total_refunds','total_payouts','net_profit_loss'])
-            st.dataframe( filtered_df[showData], use_container_width=True)
+        view_data(filtered_df, default=[
+            'month','currency','total_sales','total_refunds','total_payouts','net_profit_loss'],
+            dataset=financial_dataset, window=(start_date, end_date))
 
 
-        total_sales = filtered_df['total_sales'].sum()
-        total_refunds = filtered_df['total_refunds'].sum()
-        total_payouts = filtered_df['total_payouts'].sum()
-        net_profit_loss = filtered_df['net_profit_loss'].sum()
+        with timed('aggregate: financial totals', rows=len(filtered_df)):
+            total_sales = filtered_df['total_sales'].sum()
+            total_refunds = filtered_df['total_refunds'].sum()
+            total_payouts = filtered_df['total_payouts'].sum()
+            net_profit_loss = filtered_df['net_profit_loss'].sum()
 
 
         total1, total2 = st.columns(2, gap='small')
@@ -699,62 +1995,81 @@ class Dashboard:
         st.title("Financial Overview")
 
 
+        # The export is monthly; very long windows are bucketed coarser so each chart stays a bounded size
+        freq, _ = time_bucket(start_date, end_date, finest='M')
+        financial_series = downsample(filtered_df, 'month', ['total_sales', 'total_refunds', 'total_payouts', 'net_profit_loss'], freq)
+
         total1, total2 = st.columns(2, gap='small')
 
         with total1:
-            fig_sales = px.bar(filtered_df, x='month', y='total_sales', title='Total Sales Over Time')
-            st.plotly_chart(fig_sales)
+            fig_sales = build_figure(px.bar, financial_series, x='month', y='total_sales', title='Total Sales Over Time')
+            plotly_chart(fig_sales)
 
 
         with total2:
-            fig_refunds = px.bar(filtered_df, x='month', y='total_refunds', title='Total Refunds Over Time')
-            st.plotly_chart(fig_refunds)
+            fig_refunds = build_figure(px.bar, financial_series, x='month', y='total_refunds', title='Total Refunds Over Time')
+            plotly_chart(fig_refunds)
 
         total3, total4 = st.columns(2, gap='medium')
 
         with total3:
-            fig_payouts = px.bar(filtered_df, x='month', y='total_payouts', title='Total Payouts Over Time')
-            st.plotly_chart(fig_payouts)
+            fig_payouts = build_figure(px.bar, financial_series, x='month', y='total_payouts', title='Total Payouts Over Time')
+            plotly_chart(fig_payouts)
 
         with total4:
-            fig_net_profit_loss = px.bar(filtered_df, x='month', y='net_profit_loss', title='Net Profit/Loss Over Time')
-            st.plotly_chart(fig_net_profit_loss)
+            fig_net_profit_loss = build_figure(px.bar, financial_series, x='month', y='net_profit_loss', title='Net Profit/Loss Over Time')
+            plotly_chart(fig_net_profit_loss)
 # Main function to handle sidebar navigation
 def main():
-    s3_client = boto3.client('s3')
-    response = s3_client.get_object(Bucket='stripe-raw-data-dashboard', Key='Untitled_report.csv')# Fetch the object from S3
-    content = response['Body'].read().decode('utf-8')# Read the content
-    dashboard = Dashboard(data=content)
-
-    with st.sidebar:
-        selected = option_menu(
-            menu_title="Select a Page",
-            options=["Revenue", "Customers", "Subscriptions", "Payment", "Financial"],
-            icons=["cash", "people", "bar-chart", "credit-card", "file-text"],
-            menu_icon="cast",
-            default_index=0
-        )
+    prefetch_datasets()
+
+    with profile_render(page=None) as profile:
+        dashboard = Dashboard()
+
+        with st.sidebar:
+            selected = option_menu(
+                menu_title="Select a Page",
+                options=["Revenue", "Customers", "Subscriptions", "Payment", "Financial"],
+                icons=["cash", "people", "bar-chart", "credit-card", "file-text"],
+                menu_icon="cast",
+                default_index=0
+            )
+        profile.page = selected
 
-    # with st.sidebar:
-    #     selected = st.selectbox("Select a Page", ["Revenue", "Customers", "Subscriptions", "Payment", "Financial"])
-        
-        
+        # with st.sidebar:
+        #     selected = st.selectbox("Select a Page", ["Revenue", "Customers", "Subscriptions", "Payment", "Financial"])
+            
+            
 
-    if selected == "Revenue":
-        st.title(f"{selected}")
-        dashboard.revenue()
-    elif selected == "Customers":
-        st.header(f"{selected}")
-        dashboard.Customers()
-    elif selected == "Subscriptions":
-        st.header(f"{selected}")
-        dashboard.subscriptions()
-    elif selected == "Payment":
-        st.header(f"{selected}")
-        dashboard.payment()
-    elif selected == "Financial":
-        st.header(f"{selected}")
-        dashboard.financial()
+        if selected == "Revenue":
+            st.title(f"{selected}")
+            dashboard.revenue()
+        elif selected == "Customers":
+            st.header(f"{selected}")
+            dashboard.Customers()
+        elif selected == "Subscriptions":
+            st.header(f"{selected}")
+            dashboard.subscriptions()
+        elif selected == "Payment":
+            st.header(f"{selected}")
+            dashboard.payment()
+        elif selected == "Financial":
+            st.header(f"{selected}")
+            dashboard.financial()
+
+    with st.sidebar.expander("S3 connections"):
+        st.json(s3_connection_stats(get_s3_client()))
+
+    with st.sidebar.expander("Aggregate cache"):
+        st.json(get_aggregate_cache().stats())
+
+    if st.sidebar.checkbox("Show dataset memory"):
+        for key, dataset in get_dataset_cache().datasets().items():
+            st.sidebar.caption(key)
+            st.sidebar.json(dataset.derived('memory_report', lambda df: dataset.memory_report()), expanded=False)
+
+    if st.sidebar.checkbox("Show performance panel"):
+        show_performance_panel(profile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,322 @@
+"""Benchmark every dashboard page against synthetic Stripe-shaped exports.
+
+Generates the five CSV exports at the requested row counts, serves them through
+a local stand-in for S3 and times each stage a page goes through: S3 fetch, CSV
+parse (with and without writing the Parquet snapshot), snapshot read,
+date-window filter, aggregation and Plotly figure construction, plus the
+per-stage breakdown the dashboard's own profiler records. Loading stages are
+summed over every dataset a page reads. Pages run in Streamlit's bare mode, so
+widgets return their defaults and nothing is sent to a browser.
+
+    python benchmark.py --rows 10000 1000000 --output bench.json
+
+The JSON report is meant to be diffed between commits.
+"""
+import argparse
+import datetime
+import hashlib
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+import streamlit as st
+
+# Bare mode has no script run to attach fragments to, so st.fragment would skip
+# them entirely; run them inline instead, as a full rerun does
+st.fragment = lambda func=None, **kwargs: func if func is not None else (lambda f: f)
+
+import appv3
+
+# Page name -> (datasets it reads, the date window its widgets default to)
+PAGES = {
+    'revenue': (['invoices'], 'full'),
+    'customers': (['customers', 'subscriptions'], 'full'),
+    'subscriptions': (['subscriptions', 'customers'], 'last_30_days'),
+    'payment': (['payments'], 'full'),
+    'financial': (['financial'], 'full'),
+}
+
+# Profiler stage prefixes that make up each timed group of a render
+AGGREGATE_STAGES = ('groupby: ', 'aggregate: ', 'build: ', 'value_counts: ', 'downsample: ', 'join: ')
+FIGURE_STAGES = ('figure: ',)
+
+
+class LocalS3:
+    """Just enough of the boto3 S3 client API to serve exports from a directory."""
+
+    def __init__(self, root):
+        self.root = root
+        self._etags = {}  # path -> (mtime, size, etag), so only a changed file is hashed again
+
+    def _stat(self, key):
+        path = os.path.join(self.root, key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': key}}, 'GetObject') from None
+        cached = self._etags.get(path)
+        if cached is None or cached[:2] != (stat.st_mtime_ns, stat.st_size):
+            digest = hashlib.md5()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            cached = (stat.st_mtime_ns, stat.st_size, '"%s"' % digest.hexdigest())
+            self._etags[path] = cached
+        return path, stat.st_size, cached[2]
+
+    def head_object(self, Bucket, Key, IfNoneMatch=None):
+        _, size, etag = self._stat(Key)
+        if IfNoneMatch == etag:
+            raise ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'HeadObject')
+        return {'ETag': etag, 'ContentLength': size}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        path, size, etag = self._stat(Key)
+        if IfMatch is not None and IfMatch != etag:
+            raise ClientError({'Error': {'Code': '412', 'Message': 'Precondition Failed'}}, 'GetObject')
+        start, end = 0, size
+        if Range is not None:
+            first, _, last = Range[len('bytes='):].partition('-')
+            start, end = int(first), min(int(last) + 1, size) if last else size
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(max(end - start, 0))
+        return {'Body': StreamingBody(io.BytesIO(data), len(data)), 'ETag': etag, 'ContentLength': len(data)}
+
+
+def _timestamps(rng, n, days=180):
+    # Spread over the last `days` days so every page's default window has data
+    end = pd.Timestamp(datetime.date.today()) + pd.Timedelta(days=1)
+    seconds = rng.integers(0, days * 86400, n)
+    return end - pd.to_timedelta(seconds, unit='s')
+
+
+def _fmt(timestamps):
+    return pd.Series(timestamps).dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def generate_exports(root, rows, seed=0):
+    """Write the five exports with `rows` rows each, using the columns the pages read."""
+    rng = np.random.default_rng(seed)
+    customer_ids = np.array([f'cus_{i:08d}' for i in range(max(rows // 5, 1))])
+    products = np.array(['Starter', 'Pro', 'Team', 'Enterprise', 'Add-on seats', 'Support'])
+    countries = np.array(['US', 'GB', 'CA', 'DE', 'FR', 'AU', 'IN', None], dtype=object)
+    cities = np.array(['New York', 'London', 'Toronto', 'Berlin', 'Paris', 'Sydney', 'Mumbai', None], dtype=object)
+    statuses = np.array(['active', 'trialing', 'past_due', 'paused', 'incomplete_expired', 'canceled'])
+    failure_codes = np.array(['card_declined', 'expired_card', 'insufficient_funds', 'processing_error'])
+
+    def cents(low, high):
+        return rng.integers(low, high, rows) / 100
+
+    created = np.sort(_timestamps(rng, rows))
+    invoices = pd.DataFrame({
+        'created': _fmt(created),
+        'customer_id': rng.choice(customer_ids, rows),
+        'email': 'billing@example.com',
+        'phone': '+15555550100',
+        'name': 'Example Customer',
+        'subscription': rng.choice(np.array(['sub_monthly', 'sub_yearly', None], dtype=object), rows),
+        'invoice_number': [f'INV-{i:08d}' for i in range(rows)],
+        'description': rng.choice(products, rows),
+        'quantity': rng.integers(1, 5, rows),
+        'currency': 'usd',
+        'line_item_amount': cents(500, 50000),
+        'total_invoice_amount': cents(500, 50000),
+        'discount': cents(0, 500),
+        'fee': cents(0, 1500),
+        'tax': cents(0, 5000),
+        'net_amount': cents(500, 45000),
+    })
+
+    customers = pd.DataFrame({
+        'id': [f'cus_{i:08d}' for i in range(rows)],
+        'created': _fmt(_timestamps(rng, rows)),
+        'email': 'customer@example.com',
+        'phone': '+15555550100',
+        'name': 'Example Customer',
+        'address_country': rng.choice(countries, rows),
+        'deleted': rng.random(rows) < 0.05,
+        'shipping_address_city': rng.choice(cities, rows),
+        'shipping_address_country': rng.choice(countries, rows),
+    })
+
+    trial_start = _timestamps(rng, rows)
+    subscriptions = pd.DataFrame({
+        'customer_id': rng.choice(customer_ids, rows),
+        'created': _fmt(trial_start),
+        'trial_start': _fmt(trial_start),
+        'trial_end': _fmt(trial_start + pd.Timedelta(days=14)),
+        'start_date': _fmt(trial_start),
+        'current_period_end': _fmt(trial_start + pd.Timedelta(days=44)),
+        'status': rng.choice(statuses, rows),
+    })
+
+    status = rng.choice(np.array(['succeeded', 'failed']), rows, p=[0.9, 0.1])
+    refunded = (status == 'succeeded') & (rng.random(rows) < 0.03)
+    payments = pd.DataFrame({
+        'id': [f'ch_{i:08d}' for i in range(rows)],
+        'amount': cents(500, 50000),
+        'amount_refunded': np.where(refunded, rng.choice(np.array([5.0, 10.0, 25.0, 49.0]), rows), 0.0),
+        'balance_transaction_id': [f'txn_{i:08d}' for i in range(rows)],
+        'calculated_statement_descriptor': 'EXAMPLE',
+        'created_date': _fmt(np.sort(_timestamps(rng, rows))),
+        'currency': 'usd',
+        'customer_id': rng.choice(customer_ids, rows),
+        'description': rng.choice(products, rows),
+        'status': status,
+        'refunded': refunded,
+        'failure_code': np.where(status == 'failed', rng.choice(failure_codes, rows), None),
+    })
+
+    month = pd.Series(_timestamps(rng, rows, days=3650)).dt.to_period('M').dt.to_timestamp()
+    sales = rng.integers(1000, 100000, rows)
+    refunds = rng.integers(0, 5000, rows)
+    financial = pd.DataFrame({
+        'month': month.dt.strftime('%Y-%m-%d'),
+        'currency': 'usd',
+        'total_sales': sales,
+        'total_refunds': refunds,
+        'total_payouts': rng.integers(1000, 90000, rows),
+        'net_profit_loss': sales - refunds,
+    })
+
+    frames = {'invoices': invoices, 'customers': customers, 'subscriptions': subscriptions,
+              'payments': payments, 'financial': financial}
+    for name, frame in frames.items():
+        frame.to_csv(os.path.join(root, appv3.DATASETS[name]['key']), index=False)
+
+
+def _window(kind, dataset):
+    if kind == 'last_30_days':
+        today = datetime.date.today()
+        return today - datetime.timedelta(days=30), today
+    values = dataset.df[dataset.index].dropna()
+    return values.min().date(), values.max().date()
+
+
+def _stage_seconds(profile, prefixes):
+    # Wall time covered by the matching profiler stages; nested ones (a groupby inside a build) count once
+    intervals = sorted((stage['started'], stage['started'] + stage['seconds']) for stage in profile.stages
+                       if stage['stage'].startswith(prefixes))
+    total, covered_until = 0.0, float('-inf')
+    for start, end in intervals:
+        if end > covered_until:
+            total += end - max(start, covered_until)
+            covered_until = end
+    return total
+
+
+def _time(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def run_page(page, s3, repeat):
+    """Time every stage of one page; each value is the median over `repeat` runs, in seconds."""
+    names, window_kind = PAGES[page]
+    stages = {'fetch': [], 'parse': [], 'parse+snapshot_write': [], 'snapshot_read': [], 'filter': [], 'aggregate': [],
+              'figures': [], 'render': []}
+    loading = ['fetch', 'parse', 'parse+snapshot_write', 'snapshot_read']
+    breakdown = {}
+    rows = 0
+    for _ in range(repeat):
+        # Loading stages are summed over the page's datasets, so each sample is one page's worth
+        totals = dict.fromkeys(loading, 0.0)
+        for name in names:
+            spec = appv3.DATASETS[name]
+            seconds, response = _time(lambda: s3.get_object(Bucket=appv3.BUCKET, Key=spec['key']))
+            seconds_read, raw = _time(lambda: response['Body'].read())
+            totals['fetch'] += seconds + seconds_read
+            seconds, _ = _time(lambda: appv3.read_csv_stream(io.BytesIO(raw), spec))
+            totals['parse'] += seconds
+            snapshot = appv3.SnapshotWriter(spec['key'], response['ETag']) if appv3.pq is not None else None
+            seconds, _ = _time(lambda: appv3.read_csv_stream(io.BytesIO(raw), spec, snapshot))
+            totals['parse+snapshot_write'] += seconds
+            seconds, _ = _time(lambda: appv3.read_snapshot(spec['key'], response['ETag'], spec['columns']))
+            totals['snapshot_read'] += seconds
+        for stage in loading:
+            stages[stage].append(totals[stage])
+
+        # Warm the cache so render only measures the page itself
+        cache = appv3.DatasetCache(s3, ttl=float('inf'))
+        appv3.get_dataset_cache = lambda: cache
+        # Fresh aggregate and retention stores too, so every repeat measures the aggregation itself
+        aggregates = appv3.AggregateCache()
+        appv3.get_aggregate_cache = lambda: aggregates
+        retention = appv3.RetentionStore()
+        appv3.get_retention_store = lambda: retention
+        datasets = [appv3.get_dataset(name) for name in names]
+        rows = len(datasets[0].df)
+        start_date, end_date = _window(window_kind, datasets[0])
+        seconds, _ = _time(lambda: datasets[0].window(start_date, end_date))
+        stages['filter'].append(seconds)
+
+        dashboard = appv3.Dashboard()
+        with appv3.profile_render(page) as profile:
+            seconds, _ = _time(getattr(dashboard, {'customers': 'Customers'}.get(page, page)))
+        stages['render'].append(seconds)
+        stages['figures'].append(_stage_seconds(profile, FIGURE_STAGES))
+        stages['aggregate'].append(_stage_seconds(profile, AGGREGATE_STAGES))
+        for stage in profile.summary():
+            breakdown.setdefault(stage['stage'], []).append(stage['seconds'])
+
+    return {'rows': rows,
+            'seconds': {stage: round(statistics.median(values), 6) for stage, values in stages.items()},
+            'render_stages': {stage: round(statistics.median(values), 6) for stage, values in breakdown.items()}}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000],
+                        help='rows per export, e.g. 10000 1000000 10000000')
+    parser.add_argument('--pages', nargs='+', choices=sorted(PAGES), default=list(PAGES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+    # The per-render log lines would interleave with the report on stdout/stderr
+    appv3.perf_logger.setLevel(logging.WARNING)
+
+    report = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'pyarrow': appv3.pa.__version__ if appv3.pa is not None else None,
+        'results': [],
+    }
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as root:
+            generate_exports(root, rows)
+            appv3.SNAPSHOT_DIR = os.path.join(root, 'snapshots')
+            s3 = LocalS3(root)
+            for page in args.pages:
+                result = run_page(page, s3, args.repeat)
+                report['results'].append({'page': page, 'size': rows, **result})
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()